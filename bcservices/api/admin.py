@@ -2,16 +2,18 @@
 
 import frappe
 from frappe.utils import now_datetime
-from .utils import verify_clerk_bearer_and_get_sub, clerk_api, ensure_settings
+from .utils import verify_clerk_bearer_and_get_sub, ensure_settings, get_clerk_role
+from . import metrics as bc_metrics
+from .treasury import bump_supply
+from .http_cache import bump_market_version
+
 # -----------------------------------------------------------------------------
 # INTERNAL – CHECK ADMIN ROLE
 # -----------------------------------------------------------------------------
 
 def _require_admin():
-    clerk_id, _ = verify_clerk_bearer_and_get_sub()
-    u = clerk_api(f"/v1/users/{clerk_id}")
-    role = (u.get("public_metadata") or {}).get("role")
-    if role != "admin":
+    clerk_id, payload = verify_clerk_bearer_and_get_sub()
+    if get_clerk_role(clerk_id, payload) != "admin":
         frappe.throw("Forbidden", frappe.PermissionError)
     return clerk_id
 
@@ -30,7 +32,7 @@ def list_clients():
 
     users = frappe.get_all(
         "BC Pouzivatel",
-        fields=["name", "clerk_id", "email"]
+        fields=["name", "clerk_id", "email", "username"]
     )
 
     out = []
@@ -49,18 +51,8 @@ def list_clients():
             fields=["minuty_ostavajuce", "stav"]
         )
 
-        # username from Clerk
-        username = None
-        try:
-            cu = clerk_api(f"/v1/users/{u['clerk_id']}")
-            username = (
-                cu.get("username")
-                or cu.get("first_name")
-                or (cu.get("email_addresses")[0]["email_address"]
-                    if cu.get("email_addresses") else None)
-            )
-        except Exception:
-            pass
+        # username z lokálneho mirroru (Clerk webhook), bez volania na Clerk
+        username = u.pop("username") or u.get("email")
 
         out.append({
             **u,
@@ -102,6 +94,8 @@ def mint(quantity: int = None, priceEur: float = None, year: int = None):
         })
         d.insert(ignore_permissions=True)
 
+    bump_supply(y, vydane=qty, v_treasury=qty)
+
     settings.aktualna_cena_eur = price
     settings.save(ignore_permissions=True)
 
@@ -130,6 +124,7 @@ def set_price(newPrice: float = None, repriceTreasury: int = 0):
     settings = ensure_settings()
     settings.aktualna_cena_eur = price
     settings.save(ignore_permissions=True)
+    bump_market_version()
 
     if reprice:
         # tokens without holder = treasury
@@ -142,3 +137,20 @@ def set_price(newPrice: float = None, repriceTreasury: int = 0):
             frappe.db.set_value("BC Token", n, "povodna_cena_eur", price)
 
     return {"success": True, "priceEur": price}
+
+# -----------------------------------------------------------------------------
+# ADMIN – RUNTIME METRICS
+# -----------------------------------------------------------------------------
+
+@frappe.whitelist(methods=["GET"], allow_guest=True)
+def metrics():
+    """
+    Súhrnné počítadlá a latencie zo všetkých workerov
+    (JWKS hit/miss, ...).
+    """
+    _require_admin()
+
+    return {
+        "success": True,
+        **bc_metrics.collect()
+    }
@@ -0,0 +1,319 @@
+# apps/bcservices/bcservices/api/apns.py
+
+import json
+import os
+import threading
+import time
+
+import frappe
+import httpx
+import jwt
+from frappe.utils import cint
+
+from . import metrics
+
+# ---------------------------------------------------
+# Jediný APNs modul (VoIP aj alert pushe)
+# ---------------------------------------------------
+#
+# - jeden dlhožijúci HTTP/2 klient na worker a prostredie (sandbox / production),
+#   všetky pushe idú multiplexované cez jedno TLS spojenie
+# - .p8 kľúč sa načíta raz na proces
+# - provider token (ES256 JWT) je zdieľaný cez Redis pre všetky workery,
+#   aby sme neprekročili Apple limit na refresh tokenu
+#
+# Konfigurácia (site_config.json):
+#   apns_key_file, apns_key_id, apns_team_id, apns_bundle_id, apns_production, apns_host
+# Staré kľúče (apn_key_file, apn_key_id, apn_team_id, apn_bundle_id,
+# apn_production, apns_auth_key_path) sa stále akceptujú.
+
+PRODUCTION_HOST = "https://api.push.apple.com"
+SANDBOX_HOST = "https://api.sandbox.push.apple.com"
+
+# chyby, po ktorých je spojenie mŕtve (GOAWAY, reset, zatvorený socket)
+_RECONNECT_ERRORS = (
+    httpx.RemoteProtocolError,
+    httpx.LocalProtocolError,
+    httpx.ConnectError,
+    httpx.ReadError,
+    httpx.WriteError,
+)
+
+
+class APNsClient:
+    def __init__(self, host: str):
+        self.host = host.rstrip("/")
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _new_client(self) -> httpx.Client:
+        # plain http:// (lokálny mock) → HTTP/2 prior knowledge (h2c)
+        h2c = self.host.startswith("http://")
+        return httpx.Client(
+            http1=not h2c,
+            http2=True,
+            timeout=httpx.Timeout(10, connect=5),
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4, keepalive_expiry=None),
+        )
+
+    def client(self) -> httpx.Client:
+        # po forku nesmieme zdieľať spojenie s rodičom
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    self._client = self._new_client()
+                    self._pid = os.getpid()
+        return self._client
+
+    def reset(self, failed: httpx.Client):
+        """
+        Zahodí spojenie, ktoré zlyhalo – iba ak je to stále aktuálny klient.
+        Súbežné vlákna po GOAWAY tak nezatvoria klienta, ktorého už iné
+        vlákno postavilo na retry.
+        """
+        with self._lock:
+            if self._client is not failed:
+                return
+            self._client = None
+        if self._pid == os.getpid():
+            try:
+                failed.close()
+            except Exception:
+                pass
+
+    def post(self, device_token: str, headers: dict, body: bytes) -> httpx.Response:
+        url = f"{self.host}/3/device/{device_token}"
+
+        for attempt in (0, 1):
+            started = time.monotonic()
+            c = self.client()
+            try:
+                resp = c.post(url, headers=headers, content=body)
+            except _RECONNECT_ERRORS:
+                metrics.incr("apns.reconnects")
+                self.reset(c)
+                if attempt:
+                    metrics.incr("apns.connection_errors")
+                    raise
+                continue
+            finally:
+                metrics.observe("apns.push_latency_ms", (time.monotonic() - started) * 1000)
+
+            metrics.incr(f"apns.status.{resp.status_code}")
+            return resp
+
+
+_clients: dict[str, APNsClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(host: str) -> APNsClient:
+    c = _clients.get(host)
+    if c is None:
+        with _clients_lock:
+            c = _clients.get(host)
+            if c is None:
+                c = _clients[host] = APNsClient(host)
+    return c
+
+
+def host_for(production: bool, override: str | None = None) -> str:
+    if override:
+        return override
+    return PRODUCTION_HOST if production else SANDBOX_HOST
+
+
+# ---------------------------------------------------
+# Config & provider token
+# ---------------------------------------------------
+
+_LEGACY_KEYS = {
+    "key_file": ("apns_key_file", "apn_key_file", "apns_auth_key_path"),
+    "key_id": ("apns_key_id", "apn_key_id"),
+    "team_id": ("apns_team_id", "apn_team_id"),
+    "bundle_id": ("apns_bundle_id", "apn_bundle_id"),
+    "production": ("apns_production", "apn_production"),
+}
+
+# Apple: token platí 1 h, refresh najskôr po 20 min → obnovujeme po 50 min
+TOKEN_MAX_AGE = 50 * 60
+TOKEN_CACHE_KEY = "bc_apns_provider_token"
+
+# reason-y, po ktorých token už nikdy nebude fungovať
+DEAD_TOKEN_REASONS = ("Unregistered", "BadDeviceToken", "DeviceTokenNotForTopic")
+PROVIDER_TOKEN_REASONS = ("ExpiredProviderToken", "InvalidProviderToken")
+
+
+def config() -> frappe._dict:
+    conf = frappe.conf
+    cfg = frappe._dict()
+    for key, names in _LEGACY_KEYS.items():
+        cfg[key] = next((conf.get(n) for n in names if conf.get(n) not in (None, "")), None)
+
+    cfg.production = cint(cfg.production or 0) == 1
+    cfg.host = host_for(cfg.production, conf.get("apns_host"))
+
+    if not (cfg.key_file and cfg.key_id and cfg.team_id and cfg.bundle_id):
+        frappe.throw("APNs config missing", frappe.ConfigurationError)
+
+    return cfg
+
+
+_signing_keys: dict[str, bytes] = {}
+
+
+def _signing_key(path: str) -> bytes:
+    key = _signing_keys.get(path)
+    if key is None:
+        try:
+            with open(path, "rb") as f:
+                key = _signing_keys[path] = f.read()
+        except Exception as e:
+            frappe.throw(f"APNs key file error: {e}")
+    return key
+
+
+_local_token = {"key": None, "token": None, "iat": 0}
+
+
+def provider_token(cfg: frappe._dict | None = None) -> str:
+    """
+    ES256 provider token zdieľaný cez Redis. Podpisuje ho iba jeden worker
+    naraz (Redis lock), ostatné si ho prečítajú.
+    """
+    cfg = cfg or config()
+    cache_key = f"{TOKEN_CACHE_KEY}:{cfg.team_id}:{cfg.key_id}"
+    now = int(time.time())
+
+    if _local_token["key"] == cache_key and now - _local_token["iat"] < TOKEN_MAX_AGE:
+        return _local_token["token"]
+
+    cache = frappe.cache()
+    shared = cache.get_value(cache_key)
+
+    if not shared or now - shared["iat"] >= TOKEN_MAX_AGE:
+        lock = cache.make_key(f"{cache_key}:lock")
+        if cache.set(lock, 1, nx=True, ex=10):
+            try:
+                shared = _sign(cfg, now)
+                cache.set_value(cache_key, shared, expires_in_sec=TOKEN_MAX_AGE)
+            finally:
+                cache.delete(lock)
+        else:
+            # iný worker práve podpisuje → chvíľu počkáme na jeho token
+            for _ in range(20):
+                time.sleep(0.05)
+                shared = cache.get_value(cache_key)
+                if shared and now - shared["iat"] < TOKEN_MAX_AGE:
+                    break
+            else:
+                shared = _sign(cfg, now)
+
+    _local_token.update({"key": cache_key, **shared})
+    return shared["token"]
+
+
+def _sign(cfg: frappe._dict, now: int) -> dict:
+    token = jwt.encode(
+        {"iss": cfg.team_id, "iat": now},
+        _signing_key(cfg.key_file),
+        algorithm="ES256",
+        headers={"kid": cfg.key_id},
+    )
+    if isinstance(token, bytes):
+        token = token.decode("utf-8")
+
+    metrics.incr("apns.token_signed")
+    return {"token": token, "iat": now}
+
+
+def invalidate_provider_token(bad_token: str | None = None):
+    """Po ExpiredProviderToken / InvalidProviderToken – zahodí token, ak ho medzičasom nikto neobnovil."""
+    cfg = config()
+    cache_key = f"{TOKEN_CACHE_KEY}:{cfg.team_id}:{cfg.key_id}"
+    shared = frappe.cache().get_value(cache_key)
+
+    if bad_token is None or (shared and shared["token"] == bad_token):
+        frappe.cache().delete_value(cache_key)
+    if bad_token is None or _local_token["token"] == bad_token:
+        _local_token.update({"key": None, "token": None, "iat": 0})
+
+
+# ---------------------------------------------------
+# Push requests
+# ---------------------------------------------------
+
+def build_request(
+    device_token: str,
+    payload: dict,
+    push_type: str = "voip",
+    expiration: int | None = None,
+    priority: int = 10,
+    cfg: frappe._dict | None = None,
+):
+    """
+    Pripraví (client, headers, body) pre push. Volá sa v hlavnom threade –
+    číta frappe.conf / Redis; samotný `deliver` už frappe nepotrebuje.
+    """
+    cfg = cfg or config()
+
+    topic = f"{cfg.bundle_id}.voip" if push_type == "voip" else cfg.bundle_id
+    headers = {
+        "authorization": f"bearer {provider_token(cfg)}",
+        "apns-topic": topic,
+        "apns-push-type": push_type,
+        "apns-priority": str(priority),
+        "content-type": "application/json",
+    }
+    if expiration is not None or push_type == "voip":
+        headers["apns-expiration"] = str(int(expiration or time.time() + 30))
+
+    return get_client(cfg.host), headers, json.dumps(payload).encode()
+
+
+def deliver(client: APNsClient, device_token: str, headers: dict, body: bytes) -> dict:
+    """Jeden push – bez frappe, dá sa volať aj z thread poolu."""
+    started = time.monotonic()
+    try:
+        resp = client.post(device_token, headers, body)
+    except Exception as e:
+        return {"ok": False, "status": None, "reason": str(e), "ms": (time.monotonic() - started) * 1000}
+
+    reason = None
+    if resp.status_code != 200:
+        try:
+            reason = resp.json().get("reason")
+        except Exception:
+            reason = resp.text
+
+    return {
+        "ok": resp.status_code == 200,
+        "status": resp.status_code,
+        "reason": reason,
+        "apns_id": resp.headers.get("apns-id"),
+        "ms": (time.monotonic() - started) * 1000,
+    }
+
+
+def check_provider_token(results: list[dict], headers: dict):
+    """Ak Apple odmietol provider token, zahodíme ho (ďalší push podpíše nový)."""
+    if any(r.get("reason") in PROVIDER_TOKEN_REASONS for r in results):
+        invalidate_provider_token(headers["authorization"].split(" ", 1)[1])
+
+
+def send_push(
+    device_token: str,
+    payload: dict,
+    push_type: str = "voip",
+    expiration: int | None = None,
+    priority: int = 10,
+) -> dict:
+    """Synchronný push (VoIP alebo alert) s jedným retry po odmietnutom provider tokene."""
+    for attempt in (0, 1):
+        client, headers, body = build_request(device_token, payload, push_type, expiration, priority)
+        result = deliver(client, device_token, headers, body)
+
+        if result["reason"] not in PROVIDER_TOKEN_REASONS or attempt:
+            return result
+        check_provider_token([result], headers)
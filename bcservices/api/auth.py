@@ -2,15 +2,25 @@
 from __future__ import annotations
 
 import re
+import time
+import hmac
+import base64
 import random
+import hashlib
 import jwt
 import frappe
+from datetime import datetime, timezone
+from frappe.utils import cint, get_datetime, now_datetime, convert_utc_to_system_timezone
 from frappe.utils.password import get_decrypted_password
 
 from .utils import (
     verify_clerk_bearer_and_get_sub,
     clerk_api,
     ensure_bc_user_by_clerk,
+    clerk_primary_email,
+    get_clerk_role,
+    invalidate_clerk_role,
+    invalidate_bc_user,
     _jwks_client,
     _clerk_issuer,
 )
@@ -34,18 +44,17 @@ def sync_user():
     # Create or update BC user record
     doc = ensure_bc_user_by_clerk(clerk_id)
 
-    # Sync role (=client) back to Clerk
+    # Sync role (=client) back to Clerk – iba ak ju lokálne (claim / cache / mirror) nevidíme
     try:
-        u = clerk_api(f"/v1/users/{clerk_id}")
-        pub = (u.get("public_metadata") or {})
-
-        if pub.get("role") != "client":
-            pub["role"] = "client"
+        if get_clerk_role(clerk_id, payload) != "client":
+            # /metadata endpoint robí merge → netreba najprv GET celého usera
             clerk_api(
-                f"/v1/users/{clerk_id}",
+                f"/v1/users/{clerk_id}/metadata",
                 method="PATCH",
-                json_body={"public_metadata": pub}
+                json_body={"public_metadata": {"role": "client"}}
             )
+            frappe.db.set_value("BC Pouzivatel", doc.name, "role", "client", update_modified=False)
+            invalidate_clerk_role(clerk_id)
 
     except Exception as e:
         frappe.log_error(f"Clerk role sync failed: {e}", "BC Clerk Sync")
@@ -101,6 +110,150 @@ def sso(token: str | None = None):
     frappe.local.response["location"] = redirect_to
 
 
+# -----------------------------------------------------------------------------
+# CLERK WEBHOOK – lokálny mirror profilov (username, email, rola)
+# -----------------------------------------------------------------------------
+
+@frappe.whitelist(methods=["POST"], allow_guest=True)
+def clerk_webhook():
+    """
+    Clerk (Svix) webhook: user.created / user.updated / user.deleted.
+    MUST be allow_guest=True — Clerk nemá session ani token, overujeme Svix podpis.
+    """
+    payload = frappe.request.get_data(as_text=False)
+
+    try:
+        _verify_svix_signature(payload)
+        event = frappe.parse_json(payload.decode("utf-8"))
+    except Exception as e:
+        frappe.local.response.http_status_code = 400
+        return {"error": f"Webhook Error: {e}"}
+
+    data = event.get("data") or {}
+
+    if event.get("type") in ("user.created", "user.updated"):
+        apply_clerk_user(data)
+
+    if event.get("type") == "user.deleted" and data.get("id"):
+        name = frappe.db.get_value("BC Pouzivatel", {"clerk_id": data["id"]}, "name")
+        if name:
+            frappe.db.set_value(
+                "BC Pouzivatel",
+                name,
+                {"clerk_deleted": 1, "role": None, "clerk_updated_at": now_datetime()},
+                update_modified=False,
+            )
+        invalidate_clerk_role(data["id"])
+
+    return {"received": True}
+
+
+def _verify_svix_signature(payload: bytes):
+    secret = frappe.conf.get("clerk_webhook_secret")
+    if not secret:
+        raise ValueError("Clerk webhook secret is not configured")
+
+    msg_id = frappe.get_request_header("svix-id")
+    ts = frappe.get_request_header("svix-timestamp")
+    sig_header = frappe.get_request_header("svix-signature")
+
+    if not (msg_id and ts and sig_header):
+        raise ValueError("Missing Svix headers")
+
+    if abs(time.time() - int(ts)) > 5 * 60:
+        raise ValueError("Timestamp outside tolerance")
+
+    key = base64.b64decode(secret.split("_", 1)[1] if secret.startswith("whsec_") else secret)
+    signed = f"{msg_id}.{ts}.".encode() + payload
+    expected = base64.b64encode(hmac.new(key, signed, hashlib.sha256).digest()).decode()
+
+    for part in sig_header.split():
+        version, _, sig = part.partition(",")
+        if version == "v1" and hmac.compare_digest(sig, expected):
+            return
+
+    raise ValueError("Invalid signature")
+
+
+def apply_clerk_user(u: dict):
+    """
+    Zapíše Clerk user objekt do BC Pouzivatel (username, email, rola, updated_at).
+    Staršie eventy (podľa updated_at) sa ignorujú. Ide cez db.set_value →
+    nespúšťa on_update hook, takže nevznikne PATCH späť do Clerka.
+    """
+    clerk_id = u.get("id")
+    if not clerk_id:
+        return None
+
+    email = clerk_primary_email(u)
+    role = (u.get("public_metadata") or {}).get("role")
+    updated_at = None
+    if u.get("updated_at"):
+        # Clerk posiela epoch v ms (UTC)
+        updated_at = convert_utc_to_system_timezone(
+            datetime.fromtimestamp(u["updated_at"] / 1000, tz=timezone.utc)
+        ).replace(tzinfo=None)
+
+    name = frappe.db.get_value("BC Pouzivatel", {"clerk_id": clerk_id}, "name")
+
+    # používateľ založený vo Frappe, ktorému ešte nebol doplnený clerk_id
+    if not name and email:
+        name = frappe.db.get_value("BC Pouzivatel", {"email": email, "clerk_id": ["is", "not set"]}, "name")
+        if name:
+            frappe.db.set_value("BC Pouzivatel", name, "clerk_id", clerk_id, update_modified=False)
+            invalidate_bc_user(clerk_id)
+
+    if not name:
+        name = ensure_bc_user_by_clerk(clerk_id, email).name
+
+    stored = frappe.db.get_value("BC Pouzivatel", name, "clerk_updated_at")
+    if stored and updated_at and get_datetime(stored) > updated_at:
+        return name
+
+    frappe.db.set_value(
+        "BC Pouzivatel",
+        name,
+        {
+            "username": u.get("username"),
+            "email": email,
+            "role": role,
+            "clerk_updated_at": updated_at,
+            "clerk_deleted": 0,
+        },
+        update_modified=False,
+    )
+    invalidate_clerk_role(clerk_id)
+    invalidate_bc_user(clerk_id)
+
+    return name
+
+
+def backfill_clerk_profiles(page_size: int = 100):
+    """
+    Jednorazové naplnenie mirroru zo všetkých Clerk userov:
+    bench --site <site> execute bcservices.api.auth.backfill_clerk_profiles
+    """
+    offset = 0
+    total = 0
+
+    while True:
+        users = clerk_api(f"/v1/users?limit={int(page_size)}&offset={offset}&order_by=created_at")
+        if not users:
+            break
+
+        for u in users:
+            apply_clerk_user(u)
+
+        frappe.db.commit()
+        total += len(users)
+        offset += len(users)
+
+        if len(users) < page_size:
+            break
+
+    return {"synced": total}
+
+
 # -----------------------------------------------------------------------------
 # INTERNAL FUNCTIONS – Clerk username & upsert helpers
 # -----------------------------------------------------------------------------
@@ -156,6 +309,7 @@ def _patch_clerk_user(clerk_id: str, email: str | None, password: str | None, ne
 
     try:
         clerk_api(f"/v1/users/{clerk_id}", method="PATCH", json_body=patch)
+        invalidate_clerk_role(clerk_id)
     except Exception as e:
         # Ignore only username errors
         if new_username and "username" in str(e):
@@ -168,52 +322,162 @@ def _patch_clerk_user(clerk_id: str, email: str | None, password: str | None, ne
 # HOOKS – used internally by BC Pouzivatel DocType
 # -----------------------------------------------------------------------------
 
+# Redis per user:
+# - bc_clerk_sync_pending:<name> – set zmenených polí (+ CLERK_SYNC_CREATE),
+#   job ho preberie atomicky (SMEMBERS + DEL v MULTI)
+# - bc_clerk_sync_queued:<name>  – marker „job čaká vo fronte“ (SET NX, krátke TTL);
+#   job ho zmaže ešte pred prevzatím polí → uloženie počas behu zaradí nový job
+CLERK_SYNC_PENDING = "bc_clerk_sync_pending"
+CLERK_SYNC_QUEUED = "bc_clerk_sync_queued"
+CLERK_SYNC_QUEUED_TTL = 600
+CLERK_SYNC_CREATE = "__create__"
+CLERK_SYNC_FIELDS = ("email", "username", "heslo")
+
+
+def validate_bc_pouzivatel(doc, method=None):
+    # po uložení je v `heslo` už iba "*****" → zmenu hesla musíme zachytiť pred save
+    if doc.get("heslo") and not doc.is_dummy_password(doc.heslo):
+        doc.flags.bc_clerk_password_changed = True
+
+
 def after_insert_bc_pouzivatel(doc, method=None):
     if getattr(doc, "clerk_id", None):
         return
     if not getattr(doc, "email", None):
         return
 
-    try:
-        pw = None
-        try:
-            pw = get_decrypted_password("BC Pouzivatel", doc.name, "heslo")
-        except Exception:
-            pass
+    _queue_clerk_sync(doc.name, create=True)
+
 
-        res = _create_clerk_user(
-            email=doc.email,
-            password=pw,
-            preferred_username=getattr(doc, "username", None),
+def on_update_bc_pouzivatel(doc, method=None):
+    if not getattr(doc, "clerk_id", None):
+        return
+
+    # iba polia, ktoré Clerk zaujímajú; uloženie zariadenia a pod. nič neposiela
+    fields = [f for f in ("email", "username") if doc.has_value_changed(f)]
+    if doc.flags.bc_clerk_password_changed:
+        fields.append("heslo")
+
+    if fields or doc.get("clerk_sync_status") == "failed":
+        _queue_clerk_sync(doc.name, fields=fields)
+
+
+def _queue_clerk_sync(name: str, fields: list | None = None, create: bool = False):
+    """
+    Po commite pridá zmenené polia do pending setu v Redis a zaradí job, ak
+    pre usera ešte nečaká → viac uložení = jeden PATCH. Rollback nič nezapíše.
+    """
+    members = list(fields or []) + ([CLERK_SYNC_CREATE] if create else [])
+
+    frappe.db.set_value("BC Pouzivatel", name, "clerk_sync_status", "pending", update_modified=False)
+    frappe.db.after_commit.add(lambda: _mark_clerk_sync(name, members))
+
+
+def _clerk_sync_key(prefix: str, name: str) -> str:
+    return frappe.cache().make_key(f"{prefix}:{name}")
+
+
+def _mark_clerk_sync(name: str, members: list, retry: int = 0):
+    cache = frappe.cache()
+    if members:
+        cache.sadd(_clerk_sync_key(CLERK_SYNC_PENDING, name), *members)
+
+    if cache.set(_clerk_sync_key(CLERK_SYNC_QUEUED, name), 1, nx=True, ex=CLERK_SYNC_QUEUED_TTL):
+        frappe.enqueue(
+            "bcservices.api.auth.sync_bc_pouzivatel_to_clerk",
+            queue="default",
+            name=name,
+            retry=retry,
         )
 
-        cid = res.get("id")
-        if cid:
-            frappe.db.set_value("BC Pouzivatel", doc.name, "clerk_id", cid)
 
-        if res.get("username") and hasattr(doc, "username"):
-            frappe.db.set_value("BC Pouzivatel", doc.name, "username", res["username"])
+def _take_clerk_sync(name: str) -> set[str]:
+    key = _clerk_sync_key(CLERK_SYNC_PENDING, name)
+    pipe = frappe.cache().pipeline()
+    pipe.smembers(key)
+    pipe.delete(key)
+    members, _ = pipe.execute()
+    return {m.decode() if isinstance(m, bytes) else m for m in members}
 
-    except Exception as e:
-        frappe.log_error(f"Clerk create failed: {e}", "BC Clerk Sync")
 
+def sync_bc_pouzivatel_to_clerk(name: str, retry: int = 0):
+    """Background job: vytvorí / patchne Clerk usera, s retry a backoffom."""
+    cache = frappe.cache()
+    cache.delete(_clerk_sync_key(CLERK_SYNC_QUEUED, name))
+    members = _take_clerk_sync(name)
 
-def on_update_bc_pouzivatel(doc, method=None):
-    if not getattr(doc, "clerk_id", None):
+    if not members or not frappe.db.exists("BC Pouzivatel", name):
         return
 
-    try:
-        pw = None
+    pending = {
+        "fields": sorted(members - {CLERK_SYNC_CREATE}),
+        "create": CLERK_SYNC_CREATE in members,
+    }
+    attempts = max(1, cint(frappe.conf.get("clerk_sync_attempts") or 4))
+    last_err = None
+
+    for attempt in range(attempts):
         try:
-            pw = get_decrypted_password("BC Pouzivatel", doc.name, "heslo")
+            _sync_to_clerk(name, pending)
+            frappe.db.set_value(
+                "BC Pouzivatel",
+                name,
+                {"clerk_sync_status": "synced", "clerk_synced_at": now_datetime(), "clerk_sync_error": None},
+                update_modified=False,
+            )
+            return
+
+        except Exception as e:
+            last_err = e
+            if attempt < attempts - 1:
+                time.sleep(random.uniform(0, 2 ** attempt))
+
+    frappe.db.set_value(
+        "BC Pouzivatel",
+        name,
+        {"clerk_sync_status": "failed", "clerk_sync_error": str(last_err)[:500]},
+        update_modified=False,
+    )
+
+    # ďalšie kolo ako nový job; po poslednom ostanú polia v sete
+    # a zoberie ich job zaradený ďalším uložením usera
+    if retry < cint(frappe.conf.get("clerk_sync_retries") or 3):
+        frappe.db.after_commit.add(lambda: _mark_clerk_sync(name, sorted(members), retry + 1))
+        return
+
+    cache.sadd(_clerk_sync_key(CLERK_SYNC_PENDING, name), *members)
+    frappe.log_error(f"Clerk sync failed for {name}: {last_err}", "BC Clerk Sync")
+
+
+def _sync_to_clerk(name: str, pending: dict):
+    doc = frappe.db.get_value("BC Pouzivatel", name, ["clerk_id", "email", "username"], as_dict=True)
+
+    pw = None
+    if not doc.clerk_id or "heslo" in pending["fields"]:
+        try:
+            pw = get_decrypted_password("BC Pouzivatel", name, "heslo")
         except Exception:
             pass
 
-        _patch_clerk_user(
-            clerk_id=doc.clerk_id,
-            email=getattr(doc, "email", None),
-            password=pw,
-            new_username=getattr(doc, "username", None),
-        )
-    except Exception as e:
-        frappe.log_error(f"Clerk update failed: {e}", "BC Clerk Sync")
+    if not doc.clerk_id:
+        if not (pending.get("create") and doc.email):
+            return
+
+        res = _create_clerk_user(email=doc.email, password=pw, preferred_username=doc.username)
+
+        updates = {}
+        if res.get("id"):
+            updates["clerk_id"] = res["id"]
+        if res.get("username"):
+            updates["username"] = res["username"]
+        if updates:
+            frappe.db.set_value("BC Pouzivatel", name, updates)
+            invalidate_bc_user(updates.get("clerk_id"))
+        return
+
+    _patch_clerk_user(
+        clerk_id=doc.clerk_id,
+        email=doc.email if "email" in pending["fields"] else None,
+        password=pw if "heslo" in pending["fields"] else None,
+        new_username=doc.username if "username" in pending["fields"] else None,
+    )
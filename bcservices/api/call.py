@@ -1,11 +1,22 @@
 # apps/bcservices/bcservices/api/call.py
 
+import time
 import frappe
-from frappe.utils import now_datetime
+from frappe.query_builder import Order
+from frappe.utils import now_datetime, get_datetime, cint, add_to_date
+from frappe.utils.background_jobs import get_queues_timeout
+from . import metrics
+from .metering import meter_call
+from .realtime import publish_call_state, CALL_STATE_FIELDS
+from .stats import record_call
 from .utils import (
     verify_clerk_bearer_and_get_sub,
-    ensure_bc_user_by_clerk,
-    send_voip_push
+    voip_tokens_for_clerk_user,
+    fan_out_voip_push,
+    apply_push_feedback,
+    encode_cursor,
+    decode_cursor,
+    page_limit
 )
 
 # -----------------------------------------------------------------------------
@@ -32,29 +43,110 @@ def start():
     call.advisor = advisor
     call.status = "ringing"
     call.start_time = now_datetime()
+    call.push_status = "queued"
     call.save(ignore_permissions=True)
 
-    # Find device (BC Zariadenie) for the advisor
-    devices = frappe.get_all(
-        "BC Zariadenie",
-        filters={"parent": ["in", frappe.get_all("BC Pouzivatel", filters={"clerk_id": advisor}, pluck="name")]},
-        fields=["voip_token"]
+    publish_call_state(call.as_dict())
+
+    # VoIP push ide mimo requestu – klient dostane callId hneď
+    enqueued_at = time.time()
+    frappe.enqueue(
+        "bcservices.api.call.dispatch_call_push",
+        queue=_push_queue(),
+        timeout=PUSH_TTL * 2,
+        at_front=True,
+        enqueue_after_commit=True,
+        call_id=call.name,
+        advisor=advisor,
+        payload={
+            "callId": call.name,
+            "title": "Prichádzajúci hovor",
+            "body": "Volá poradca",
+        },
+        enqueued_at=enqueued_at,
+        expires_at=int(enqueued_at) + PUSH_TTL,
+    )
+
+    return {"success": True, "callId": call.name, "pushStatus": "queued"}
+
+
+# -----------------------------------------------------------------------------
+# PUSH DISPATCH (background, high priority queue)
+# -----------------------------------------------------------------------------
+
+# apns-expiration: po 30 s už zvonenie nemá zmysel
+PUSH_TTL = 30
+
+# dedikovaný front s vlastným workerom (README → Push worker),
+# pushe tak nečakajú za bežnými jobmi v `short`
+PUSH_QUEUE = "bc_push"
+
+FINAL_STATUSES = ("ended", "missed", "declined")
+
+
+def dispatch_call_push(call_id: str, advisor: str, payload: dict, enqueued_at: float, expires_at: int):
+    """
+    Background job: fan-out VoIP pushu na zariadenia advisora.
+    Job po `expires_at` sa zahodí; výsledok sa zapíše na BC Call.
+    """
+    started = time.time()
+    queue_delay_ms = int((started - enqueued_at) * 1000)
+    metrics.observe("voip.queue_delay_ms", queue_delay_ms)
+
+    update = {"push_queue_delay_ms": queue_delay_ms}
+
+    if started >= expires_at:
+        metrics.incr("voip.expired_jobs")
+        update["push_status"] = "expired"
+        frappe.db.set_value("BC Call", call_id, update, update_modified=False)
+        return
+
+    # hovor medzitým odmietnutý / ukončený / zmeškaný → telefón už nezvoní
+    if frappe.db.get_value("BC Call", call_id, "status") != "ringing":
+        metrics.incr("voip.cancelled_jobs")
+        update["push_status"] = "cancelled"
+        frappe.db.set_value("BC Call", call_id, update, update_modified=False)
+        return
+
+    devices = voip_tokens_for_clerk_user(advisor)
+    if not devices:
+        update["push_status"] = "no_devices"
+        frappe.db.set_value("BC Call", call_id, update, update_modified=False)
+        return
+
+    deliveries = fan_out_voip_push(
+        devices,
+        payload,
+        deadline=min(float(frappe.conf.get("voip_push_deadline") or 5), expires_at - started),
+        expiration=expires_at,
     )
+    apply_push_feedback(deliveries)
 
-    # Send VoIP push (optional but needed for iOS)
-    if devices:
-        dev = devices[0]
-        if dev.voip_token:
-            send_voip_push(
-                dev.voip_token,
-                {
-                    "callId": call.name,
-                    "title": "Prichádzajúci hovor",
-                    "body": "Volá poradca",
-                }
-            )
+    delivered = [d["ms"] for d in deliveries if d["ok"]]
+    if delivered:
+        metrics.observe("voip.delivery_latency_ms", min(delivered))
+        update.update({
+            "push_status": "delivered",
+            "push_delivered_at": now_datetime(),
+            "push_latency_ms": int(min(delivered)),
+        })
+    else:
+        update["push_status"] = "failed"
+        frappe.log_error(f"VoIP push failed for call {call_id}: {deliveries}", "BC APNs")
 
-    return {"success": True, "callId": call.name}
+    update["push_result"] = frappe.as_json([
+        {"device": d["device"], "ok": d["ok"], "status": d["status"], "reason": d["reason"]}
+        for d in deliveries
+    ])
+    frappe.db.set_value("BC Call", call_id, update, update_modified=False)
+
+def _push_queue() -> str:
+    queue = frappe.conf.get("bc_push_queue") or PUSH_QUEUE
+    if queue not in get_queues_timeout():
+        # worker pre front nie je v common_site_config → start nesmie zlyhať
+        metrics.incr("voip.push_queue_missing")
+        return "short"
+    return queue
 
 # -----------------------------------------------------------------------------
 # ACCEPT CALL (client accepts after VoIP push)
@@ -66,23 +158,42 @@ def accept():
     iOS → /api/method/bcservices.api.call.accept
     """
     clerk_id, payload = verify_clerk_bearer_and_get_sub()
-    data = frappe.local.form_dict or {}
-    call_id = data.get("callId")
-
-    if not call_id:
-        frappe.throw("Missing callId")
-
-    doc = frappe.get_doc("BC Call", call_id)
+    call = _lock_call((frappe.local.form_dict or {}).get("callId"))
 
     # Only advisor (client) can accept
-    if doc.advisor != clerk_id:
+    if call.advisor != clerk_id:
         frappe.throw("You cannot accept someone else's call", frappe.PermissionError)
 
-    doc.status = "ongoing"
-    doc.answered_time = now_datetime()
-    doc.save(ignore_permissions=True)
+    if call.status == "ongoing":
+        return {"success": True, "status": call.status}
+    if call.status != "ringing":
+        frappe.throw(f"Call is {call.status}", frappe.ValidationError)
+
+    _transition(call, "ongoing", answered_time=now_datetime())
+    return {"success": True, "status": "ongoing"}
+
+# -----------------------------------------------------------------------------
+# DECLINE CALL
+# -----------------------------------------------------------------------------
+@frappe.whitelist(methods=["POST"], allow_guest=True)
+def decline():
+    """
+    Klient odmietne zvoniaci hovor.
+    iOS → /api/method/bcservices.api.call.decline
+    """
+    clerk_id, payload = verify_clerk_bearer_and_get_sub()
+    call = _lock_call((frappe.local.form_dict or {}).get("callId"))
+
+    if call.advisor != clerk_id:
+        frappe.throw("You cannot decline someone else's call", frappe.PermissionError)
 
-    return {"success": True}
+    if call.status in FINAL_STATUSES:
+        return {"success": True, "status": call.status}
+    if call.status != "ringing":
+        frappe.throw(f"Call is {call.status}", frappe.ValidationError)
+
+    _transition(call, "declined", end_time=now_datetime())
+    return {"success": True, "status": "declined"}
 
 # -----------------------------------------------------------------------------
 # END CALL
@@ -93,41 +204,219 @@ def end():
     Ktorákoľvek strana ukončí hovor.
     """
     clerk_id, payload = verify_clerk_bearer_and_get_sub()
-    data = frappe.local.form_dict or {}
-    call_id = data.get("callId")
+    call = _lock_call((frappe.local.form_dict or {}).get("callId"))
+
+    # ukončenie = zúčtovanie → iba účastník hovoru
+    if clerk_id not in (call.caller, call.advisor):
+        frappe.throw("Forbidden", frappe.PermissionError)
+
+    # dva súbežné end() hovor neukončia (a nezúčtujú) dvakrát – riadok je zamknutý
+    if call.status in FINAL_STATUSES:
+        return {"success": True, "status": call.status}
 
+    _transition(call, "ended", end_time=now_datetime(), meter=True)
+
+    return {
+        "success": True,
+        "status": "ended",
+        "billedSeconds": call.get("billed_seconds") or 0,
+        "billedMinutes": call.get("billed_minutes") or 0,
+        "unbilledMinutes": call.get("unbilled_minutes") or 0,
+    }
+
+# -----------------------------------------------------------------------------
+# CALL STATE (resync po reconnecte socketu)
+# -----------------------------------------------------------------------------
+@frappe.whitelist(methods=["GET"], allow_guest=True)
+def state(callId: str = None):
+    """
+    Aktuálny stav hovoru – iba pre účastníkov. Zmeny prichádzajú
+    realtime eventom `bc_call_state`; toto je iba jednorazový resync.
+    """
+    clerk_id, payload = verify_clerk_bearer_and_get_sub()
+    call = frappe.db.get_value("BC Call", callId, CALL_STATE_FIELDS, as_dict=True) if callId else None
+
+    if not call:
+        frappe.throw("Call not found", frappe.DoesNotExistError)
+    if clerk_id not in (call.caller, call.advisor):
+        frappe.throw("Forbidden", frappe.PermissionError)
+
+    return {"success": True, "call": call}
+
+
+def _lock_call(call_id: str | None) -> frappe._dict:
     if not call_id:
         frappe.throw("Missing callId")
 
-    doc = frappe.get_doc("BC Call", call_id)
+    call = frappe.db.get_value("BC Call", call_id, CALL_STATE_FIELDS, as_dict=True, for_update=True)
+    if not call:
+        frappe.throw("Call not found", frappe.DoesNotExistError)
+    return call
+
+
+def _transition(call: frappe._dict, status: str, meter: bool = False, **values):
+    """Zmena stavu zamknutého hovoru + realtime event oboch stranám (po commite)."""
+    values["status"] = status
+    frappe.db.set_value("BC Call", call.name, values)
+    call.update(values)
 
-    doc.status = "ended"
-    doc.end_time = now_datetime()
-    doc.save(ignore_permissions=True)
+    if meter:
+        call.update(meter_call(call.name) or {})
+    if status in FINAL_STATUSES:
+        record_call(call)
 
-    return {"success": True}
+    publish_call_state(call)
 
 # -----------------------------------------------------------------------------
 # CALL HISTORY
 # -----------------------------------------------------------------------------
 @frappe.whitelist(methods=["GET"], allow_guest=True)
-def history(userId: str):
+def history(
+    userId: str,
+    limit: int = None,
+    cursor: str = None,
+    since: str = None,
+    until: str = None,
+    includeAdvisor: int = 0,
+):
     """
     iOS: get call history for user.
     Security: user can view only their own history.
+
+    Stránkovanie cez keyset cursor na (start_time, name) – každá stránka
+    je jeden rozsah z indexu (caller, start_time), bez OFFSET.
+    - limit: 1..200 (default 50)
+    - cursor: `nextCursor` z predchádzajúcej stránky
+    - since / until: rozsah start_time (since vrátane, until bez)
+    - includeAdvisor=1: aj hovory, kde je user prijímateľ
     """
     clerk_id, payload = verify_clerk_bearer_and_get_sub()
 
     if clerk_id != userId:
         frappe.throw("Forbidden", frappe.PermissionError)
 
-    calls = frappe.get_all(
+    limit = page_limit(limit)
+    after = decode_cursor(cursor, 2)
+    if after:
+        after[0] = get_datetime(after[0])
+
+    columns = ["caller", "advisor"] if cint(includeAdvisor) else ["caller"]
+
+    # pri includeAdvisor dva index-backed dotazy (caller / advisor) zlúčené
+    # v Pythone – rýchlejšie ako `caller = %s or advisor = %s` s filesortom
+    calls = {}
+    for column in columns:
+        for c in _history_page(column, userId, after, since, until, limit + 1):
+            calls[c.name] = c
+
+    calls = sorted(calls.values(), key=lambda c: (c.start_time, c.name), reverse=True)
+    has_more = len(calls) > limit
+    calls = calls[:limit]
+
+    return {
+        "success": True,
+        "calls": calls,
+        "nextCursor": encode_cursor(calls[-1].start_time, calls[-1].name) if has_more else None,
+    }
+
+
+def _history_page(column: str, user: str, after: list | None, since, until, limit: int):
+    Call = frappe.qb.DocType("BC Call")
+    q = (
+        frappe.qb.from_(Call)
+        .select(
+            Call.name,
+            Call.caller,
+            Call.advisor,
+            Call.status,
+            Call.start_time,
+            Call.answered_time,
+            Call.end_time,
+            Call.billed_minutes,
+        )
+        .where(Call[column] == user)
+    )
+
+    if since:
+        q = q.where(Call.start_time >= get_datetime(since))
+    if until:
+        q = q.where(Call.start_time < get_datetime(until))
+    if after:
+        ts, name = after
+        q = q.where((Call.start_time < ts) | ((Call.start_time == ts) & (Call.name < name)))
+
+    return (
+        q.orderby(Call.start_time, order=Order.desc)
+        .orderby(Call.name, order=Order.desc)
+        .limit(limit)
+        .run(as_dict=True)
+    )
+
+# -----------------------------------------------------------------------------
+# SWEEPER (scheduler, každú minútu)
+# -----------------------------------------------------------------------------
+
+def sweep_stale_calls():
+    """
+    Uzavrie visiace hovory – jeden set-based UPDATE na prechod:
+    - ringing dlhšie ako `call_ring_timeout` (s) → missed
+    - ongoing dlhšie ako `call_max_duration` (s) → ended, end_time orezaný na max. dĺžku
+
+    Dotknuté riadky označí `modified = run_ts`, podľa toho ich potom
+    zúčtuje a pošle realtime event.
+    """
+    now = run_ts = now_datetime()   # run_ts = marker behu (timestamp s mikrosekundami)
+    ring_timeout = cint(frappe.conf.get("call_ring_timeout") or 60)
+    max_duration = cint(frappe.conf.get("call_max_duration") or 3600)
+
+    Call = frappe.qb.DocType("BC Call")
+    (
+        frappe.qb.update(Call)
+        .set(Call.status, "missed")
+        .set(Call.end_time, now)
+        .set(Call.modified, run_ts)
+        .where(Call.status == "ringing")
+        .where(Call.start_time < add_to_date(now, seconds=-ring_timeout))
+    ).run()
+
+    values = {"run_ts": run_ts, "cutoff": add_to_date(now, seconds=-max_duration), "max": max_duration}
+    if frappe.db.db_type == "postgres":
+        frappe.db.sql(
+            """
+            update "tabBC Call"
+            set status = 'ended',
+                end_time = coalesce(answered_time, start_time) + make_interval(secs => %(max)s),
+                modified = %(run_ts)s
+            where status = 'ongoing' and coalesce(answered_time, start_time) < %(cutoff)s
+            """,
+            values,
+        )
+    else:
+        frappe.db.sql(
+            """
+            update `tabBC Call`
+            set status = 'ended',
+                end_time = coalesce(answered_time, start_time) + interval %(max)s second,
+                modified = %(run_ts)s
+            where status = 'ongoing' and coalesce(answered_time, start_time) < %(cutoff)s
+            """,
+            values,
+        )
+
+    swept = frappe.get_all(
         "BC Call",
-        filters={
-            "caller": userId
-        },
-        fields=["name", "advisor", "status", "start_time", "end_time"],
-        order_by="start_time desc",
+        filters={"modified": run_ts, "status": ["in", ["missed", "ended"]]},
+        fields=CALL_STATE_FIELDS,
     )
 
-    return {"success": True, "calls": calls}
+    for call in swept:
+        if call.status == "ended":
+            call.update(meter_call(call.name) or {})
+        record_call(call)
+        publish_call_state(call)
+
+    if swept:
+        metrics.incr("calls.swept_missed", sum(1 for c in swept if c.status == "missed"))
+        metrics.incr("calls.swept_capped", sum(1 for c in swept if c.status == "ended"))
+
+    return len(swept)
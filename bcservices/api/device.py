@@ -28,7 +28,7 @@ def register_device():
         frappe.throw("Missing voip_token")
 
     # nájdi alebo vytvor BC Pouzivatel podľa Clerk ID
-    user_doc = ensure_bc_user_by_clerk(clerk_id)
+    user_doc = ensure_bc_user_by_clerk(clerk_id, as_doc=True)
 
     # upsert zariadenia – zabezpečí:
     # - update tokenu ak existuje
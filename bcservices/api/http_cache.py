@@ -0,0 +1,84 @@
+# apps/bcservices/bcservices/api/http_cache.py
+
+import hashlib
+import json
+
+import frappe
+from frappe.utils import cint
+from werkzeug.wrappers import Response
+
+from . import metrics
+
+# ---------------------------------------------------
+# Verzované HTTP cache pre verejné market endpointy
+# ---------------------------------------------------
+#
+# - globálna „market version“ v Redis; zvyšujú ju zápisy (mint, cena,
+#   nákup, listing, predaj, spotreba) až PO commite transakcie
+# - ETag = názov endpointu + verzia + parametre → If-None-Match → 304
+# - Cache-Control: public, max-age / s-maxage (CDN) – `public_cache_max_age`
+# - vyrenderovaný JSON je v Redis pod (endpoint, verzia, parametre),
+#   takže aj cache miss na CDN stojí iba jeden GET z Redis
+
+MARKET_VERSION_KEY = "bc_market_version"
+BODY_TTL = 3600
+
+
+def market_version() -> int:
+    cache = frappe.cache()
+    return cint(cache.get(cache.make_key(MARKET_VERSION_KEY)))
+
+
+def bump_market_version():
+    """Zvýši verziu po commite aktuálnej transakcie (max. raz za transakciu)."""
+    if getattr(frappe.local, "bc_market_bump_pending", False):
+        return
+    frappe.local.bc_market_bump_pending = True
+    frappe.db.after_commit.add(_bump_now)
+    frappe.db.after_rollback.add(_clear_pending)
+
+
+def _bump_now():
+    frappe.local.bc_market_bump_pending = False
+    cache = frappe.cache()
+    cache.incr(cache.make_key(MARKET_VERSION_KEY))
+    metrics.incr("http_cache.version_bumps")
+
+
+def _clear_pending():
+    frappe.local.bc_market_bump_pending = False
+
+
+def cached_json(name: str, params: dict, build, max_age: int | None = None) -> Response:
+    """
+    Vráti Response s `{"message": build()}` (rovnaký tvar ako bežné API),
+    s ETag / Cache-Control; pri zhode If-None-Match → 304 bez tela.
+    """
+    max_age = cint(frappe.conf.get("public_cache_max_age") or 10) if max_age is None else max_age
+    version = market_version()
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    etag = f'W/"{name}-{version}-{digest}"'
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}, s-maxage={max_age}",
+        "Vary": "Accept-Encoding",
+    }
+
+    if_none_match = frappe.get_request_header("If-None-Match") or ""
+    if etag in [t.strip() for t in if_none_match.split(",")]:
+        metrics.incr(f"http_cache.{name}.not_modified")
+        return Response(status=304, headers=headers)
+
+    cache = frappe.cache()
+    key = cache.make_key(f"bc_http:{name}:{version}:{digest}")
+    body = cache.get(key)
+
+    if body is None:
+        metrics.incr(f"http_cache.{name}.miss")
+        body = frappe.as_json({"message": build()}, indent=None).encode()
+        cache.set(key, body, ex=BODY_TTL)
+    else:
+        metrics.incr(f"http_cache.{name}.hit")
+
+    return Response(body, status=200, headers=headers, content_type="application/json; charset=utf-8")
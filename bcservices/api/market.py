@@ -1,12 +1,21 @@
 # apps/bcservices/bcservices/api/market.py
 
+from decimal import Decimal, InvalidOperation
+
 import frappe
-from frappe.utils import now_datetime
+from frappe.query_builder import Order
+from frappe.utils import now_datetime, cint, flt, get_datetime
 from .utils import (
     verify_clerk_bearer_and_get_sub,
     ensure_bc_user_by_clerk,
-    ensure_settings
+    ensure_settings,
+    encode_cursor,
+    decode_cursor,
+    page_limit
 )
+from .treasury import claim_treasury_tokens, assign_tokens, insert_purchase_items, bump_supply
+from .http_cache import cached_json
+from .orderbook import add_ask, remove_ask, claim_asks, best_ask, depth
 
 # -----------------------------------------------------------------------------
 # PURCHASE TOKENS FROM TREASURY
@@ -50,23 +59,8 @@ def purchase(userId: str = None, quantity: int = None, year: int = None):
             frappe.ValidationError
         )
 
-    # Get available treasury tokens
-    available = frappe.get_all(
-        "BC Token",
-        filters={
-            "aktualny_drzitel": ["is", "null"],
-            "vydany_rok": year,
-            "stav": "active"
-        },
-        fields=["name"],
-        order_by="creation asc",
-        limit_page_length=quantity,
-    )
-
-    if len(available) < quantity:
-        frappe.throw("Not enough tokens in treasury", frappe.ValidationError)
-
-    purchased = [a["name"] for a in available]
+    # Claim treasury tokens (FOR UPDATE SKIP LOCKED – súbežní kupujúci dostanú rôzne tokeny)
+    purchased = claim_treasury_tokens(quantity, year)
 
     # Create transaction record (ledger)
     tr = frappe.get_doc({
@@ -80,22 +74,21 @@ def purchase(userId: str = None, quantity: int = None, year: int = None):
     tr.insert(ignore_permissions=True)
     tr.submit()
 
-    # Assign tokens to user
-    for token_name in purchased:
-        frappe.db.set_value("BC Token", token_name, "aktualny_drzitel", user.name)
-
-    # Optional purchase item records
-    for token_name in purchased:
-        try:
-            item = frappe.get_doc({
-                "doctype": "BC Polozka Nakupu",
-                "token": token_name,
-                "jednotkova_cena_eur": unit_price,
-                "rok": year
-            })
-            item.insert(ignore_permissions=True)
-        except Exception:
-            pass
+    # Payment record + ownership transfer + purchase items – set-based,
+    # počet príkazov nezávisí od quantity
+    p = frappe.get_doc({
+        "doctype": "BC Platba",
+        "kupujuci": user.name,
+        "typ": "treasury",
+        "mnozstvo": quantity,
+        "rok": year,
+        "suma_eur": unit_price * quantity,
+        "stav": "paid",
+    })
+    p.insert(ignore_permissions=True)
+
+    assign_tokens(purchased, user.name, year)
+    insert_purchase_items(p.name, purchased, unit_price, year)
 
     # Prepare response
     tokens = frappe.get_all(
@@ -122,6 +115,7 @@ def purchase(userId: str = None, quantity: int = None, year: int = None):
         "unitPrice": unit_price,
         "quantity": quantity,
         "purchasedTokenIds": purchased,
+        "paymentId": p.name,
         "totalMinutes": total,
         "tokens": tokens
     }
@@ -174,6 +168,8 @@ def list_token(sellerId: str = None, tokenId: str = None, priceEur: float = None
 
     faria = tokenId
     frappe.db.set_value("BC Token", tok.name, "stav", "listed")
+    add_ask(lst.name, tok.vydany_rok, price, lst.creation)
+    bump_supply(tok.vydany_rok, drzane=-1, na_predaj=1)
 
     return {"success": True, "listing": {"name": lst.name}}
 
@@ -209,6 +205,8 @@ def cancel_listing(sellerId: str = None, listingId: str = None):
     lst.save(ignore_permissions=True)
 
     frappe.db.set_value("BC Token", tok.name, "stav", "active")
+    remove_ask(lst.name)
+    bump_supply(tok.vydany_rok, na_predaj=-1, drzane=1)
 
     return {"success": True}
 
@@ -218,18 +216,42 @@ def cancel_listing(sellerId: str = None, listingId: str = None):
 # -----------------------------------------------------------------------------
 
 @frappe.whitelist(methods=["POST"], allow_guest=True)
-def buy_listing(buyerId: str = None, listingId: str = None):
+def buy_listing(
+    buyerId: str = None,
+    listingId: str = None,
+    mode: str = None,
+    year: int = None,
+    quantity: int = None,
+    maxPrice: float = None,
+):
+    """
+    - mode=limit (default): kúpi konkrétny listing `listingId`
+    - mode=market: kúpi `quantity` najlacnejších tokenov ročníka `year`
+      z order booku (price-time priority), voliteľne najviac za `maxPrice` / ks
+    """
     clerk_id, _ = verify_clerk_bearer_and_get_sub()
 
     data = frappe.local.form_dict
     buyerId = buyerId or data.get("buyerId") or clerk_id
     listingId = listingId or data.get("listingId")
+    mode = mode or data.get("mode") or "limit"
+
+    if mode == "market":
+        return _buy_market(
+            buyerId,
+            year or data.get("year"),
+            quantity or data.get("quantity"),
+            maxPrice if maxPrice is not None else data.get("maxPrice"),
+        )
+
+    if mode != "limit":
+        frappe.throw("Invalid mode", frappe.ValidationError)
 
     if not buyerId or not listingId:
         frappe.throw("Missing buyerId/listingId", frappe.ValidationError)
 
     buyer = ensure_bc_user_by_clerk(buyerId)
-    lst = frappe.get_doc("BC Inzerat", listingId)
+    lst = frappe.get_doc("BC Inzerat", listingId, for_update=True)
 
     if lst.stav != "open":
         frappe.throw("Listing nie je dostupný", frappe.ValidationError)
@@ -252,6 +274,57 @@ def buy_listing(buyerId: str = None, listingId: str = None):
             frappe.ValidationError
         )
 
+    remove_ask(lst.name)
+    return {"success": True, **_execute_sale(lst, tok, buyer)}
+
+
+def _buy_market(buyerId: str, year, quantity, maxPrice) -> dict:
+    year = cint(year) or now_datetime().year
+    quantity = cint(quantity)
+    max_price = flt(maxPrice) if maxPrice not in (None, "") else None
+
+    if not buyerId or quantity <= 0:
+        frappe.throw("Missing buyerId/quantity", frappe.ValidationError)
+
+    buyer = ensure_bc_user_by_clerk(buyerId)
+
+    owned = frappe.db.count("BC Token", {
+        "aktualny_drzitel": buyer.name,
+        "vydany_rok": year,
+        "stav": ["in", ["active", "listed"]]
+    })
+
+    if owned + quantity > 20:
+        frappe.throw(
+            f"Limit 20 tokenov pre rok {year} dosiahnutý",
+            frappe.ValidationError
+        )
+
+    # kandidáti z order booku, v DB zamknuté a overené (SKIP LOCKED)
+    names = claim_asks(year, quantity, buyer.name, max_price)
+
+    # z knihy ešte pred zápismi → zmena knihy predbehne bump verzie
+    for name in names:
+        remove_ask(name)
+
+    trades = []
+    for name in names:
+        lst = frappe.get_doc("BC Inzerat", name)
+        tok = frappe.get_doc("BC Token", lst.token)
+        trades.append(_execute_sale(lst, tok, buyer))
+
+    return {
+        "success": True,
+        "mode": "market",
+        "year": year,
+        "quantity": len(trades),
+        "totalEur": sum(t["priceEur"] for t in trades),
+        "trades": trades
+    }
+
+
+def _execute_sale(lst, tok, buyer) -> dict:
+    """Zápis predaja zamknutého listingu (listing, token, obchod, ledger)."""
     # lock listing + transfer token
     lst.stav = "sold"
     lst.uzavrete_kedy = now_datetime()
@@ -265,6 +338,7 @@ def buy_listing(buyerId: str = None, listingId: str = None):
         frappe.throw("Token nie je možné kúpiť", frappe.ValidationError)
 
     frappe.db.set_value("BC Token", tok.name, {"aktualny_drzitel": buyer.name, "stav": "active"})
+    bump_supply(tok.vydany_rok, na_predaj=-1, drzane=1)
 
     # Create trade record
     trade = frappe.get_doc({
@@ -294,7 +368,6 @@ def buy_listing(buyerId: str = None, listingId: str = None):
         tx.submit()
 
     return {
-        "success": True,
         "tradeId": trade.name,
         "tokenId": tok.name,
         "priceEur": float(lst.cena_eur)
@@ -305,12 +378,125 @@ def buy_listing(buyerId: str = None, listingId: str = None):
 # PUBLIC LISTINGS
 # -----------------------------------------------------------------------------
 
+LISTING_SORTS = ("recent", "price")
+
+
 @frappe.whitelist(methods=["GET"], allow_guest=True)
-def listings():
-    items = frappe.get_all(
-        "BC Inzerat",
-        filters={"stav": "open"},
-        order_by="creation desc",
-        fields=["name", "token", "predavajuci", "cena_eur", "creation"]
+def listings(
+    limit: int = None,
+    cursor: str = None,
+    year: int = None,
+    minPrice: float = None,
+    maxPrice: float = None,
+    minMinutes: int = None,
+    sort: str = "recent",
+):
+    """
+    Verejný zoznam otvorených listingov (ETag / 304, Cache-Control pre CDN).
+
+    - keyset stránkovanie: `nextCursor` z predchádzajúcej stránky
+    - filtre: year (ročník tokenu), minPrice / maxPrice, minMinutes
+    - sort: recent (najnovšie) | price (najlacnejšie)
+    """
+    sort = sort or "recent"
+    if sort not in LISTING_SORTS:
+        frappe.throw("Invalid sort", frappe.ValidationError)
+
+    params = {
+        "limit": page_limit(limit),
+        "cursor": cursor or None,
+        "year": cint(year) or None,
+        "minPrice": flt(minPrice) if minPrice not in (None, "") else None,
+        "maxPrice": flt(maxPrice) if maxPrice not in (None, "") else None,
+        "minMinutes": cint(minMinutes) or None,
+        "sort": sort,
+    }
+    return cached_json("listings", params, lambda: _open_listings(**params))
+
+
+def _open_listings(limit, cursor, year, minPrice, maxPrice, minMinutes, sort):
+    """
+    Jeden join BC Inzerat ⋈ BC Token. Poradie (cena_eur, name) alebo
+    (creation, name) sedí na indexy (stav, cena_eur) / (stav, creation).
+    """
+    Listing = frappe.qb.DocType("BC Inzerat")
+    Token = frappe.qb.DocType("BC Token")
+
+    q = (
+        frappe.qb.from_(Listing)
+        .join(Token)
+        .on(Token.name == Listing.token)
+        .select(
+            Listing.name,
+            Listing.token,
+            Listing.predavajuci,
+            Listing.cena_eur,
+            Listing.creation,
+            Token.vydany_rok.as_("issuedYear"),
+            Token.minuty_ostavajuce.as_("minutesRemaining"),
+        )
+        .where(Listing.stav == "open")
     )
-    return {"items": items}
+
+    if year:
+        q = q.where(Token.vydany_rok == year)
+    if minPrice is not None:
+        q = q.where(Listing.cena_eur >= minPrice)
+    if maxPrice is not None:
+        q = q.where(Listing.cena_eur <= maxPrice)
+    if minMinutes:
+        q = q.where(Token.minuty_ostavajuce >= minMinutes)
+
+    after = decode_cursor(cursor, 2)
+    if sort == "price":
+        if after:
+            # Decimal → numerický literál, DB porovná decimal presne
+            # (string by MariaDB porovnala ako float)
+            price, name = _cursor_price(after[0]), after[1]
+            q = q.where((Listing.cena_eur > price) | ((Listing.cena_eur == price) & (Listing.name > name)))
+        q = q.orderby(Listing.cena_eur, order=Order.asc).orderby(Listing.name, order=Order.asc)
+    else:
+        if after:
+            created, name = get_datetime(after[0]), after[1]
+            q = q.where((Listing.creation < created) | ((Listing.creation == created) & (Listing.name < name)))
+        q = q.orderby(Listing.creation, order=Order.desc).orderby(Listing.name, order=Order.desc)
+
+    items = q.limit(limit + 1).run(as_dict=True)
+    has_more = len(items) > limit
+    items = items[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = items[-1]
+        next_cursor = encode_cursor(last.cena_eur if sort == "price" else last.creation, last.name)
+
+    return {"items": items, "nextCursor": next_cursor}
+
+
+def _cursor_price(value) -> Decimal:
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        frappe.throw("Invalid cursor", frappe.ValidationError)
+
+
+# -----------------------------------------------------------------------------
+# PUBLIC ORDER BOOK
+# -----------------------------------------------------------------------------
+
+@frappe.whitelist(methods=["GET"], allow_guest=True)
+def order_book(year: int = None, levels: int = 10):
+    """Best ask a hĺbka (počet tokenov per cenová úroveň) pre ročník."""
+    params = {
+        "year": cint(year) or now_datetime().year,
+        "levels": min(max(cint(levels) or 10, 1), 50),
+    }
+    return cached_json("order_book", params, lambda: _order_book(**params))
+
+
+def _order_book(year: int, levels: int) -> dict:
+    return {
+        "year": year,
+        "bestAsk": best_ask(year),
+        "levels": depth(year, levels)
+    }
@@ -0,0 +1,180 @@
+# apps/bcservices/bcservices/api/metering.py
+
+import math
+
+import frappe
+from frappe.query_builder import Case
+from frappe.utils import get_datetime, now_datetime, add_to_date
+
+from . import metrics
+from .treasury import bump_supply
+
+# ---------------------------------------------------
+# Účtovanie minút hovoru z BC Token
+# ---------------------------------------------------
+#
+# - účtuje sa answered_time → end_time, zaokrúhlené nahor na celé minúty
+# - platí klient (na BC Call je to `advisor` – prijímateľ hovoru od poradcu),
+#   tokeny sa míňajú od najstaršieho ročníka
+# - celé zúčtovanie = pár set-based príkazov v jednej transakcii:
+#     1. lock BC Call (SELECT ... FOR UPDATE) → hovor sa zúčtuje práve raz
+#     2. lock aktívnych tokenov platiteľa → súbežné hovory toho istého
+#        klienta sa serializujú a zostatky nemôžu ísť do mínusu
+#     3. jeden UPDATE (CASE) pre všetky dotknuté tokeny, vyčerpané → spent
+#     4. jeden bulk INSERT do BC Dennik hovorov (riadok na token)
+#     5. jeden UPDATE BC Call s výsledkom
+
+CALL_FIELDS = ["name", "caller", "advisor", "status", "answered_time", "end_time", "metered_at"]
+
+
+def billable_seconds(answered_time, end_time) -> int:
+    if not answered_time or not end_time:
+        return 0
+    return max(0, int((get_datetime(end_time) - get_datetime(answered_time)).total_seconds()))
+
+
+def meter_call(call_id: str) -> dict | None:
+    """
+    Zúčtuje ukončený hovor. Volať v transakcii, ktorá hovor ukončila
+    (end_time musí byť nastavený). Opakované volanie nič nespraví → None.
+    """
+    call = frappe.db.get_value("BC Call", call_id, CALL_FIELDS, as_dict=True, for_update=True)
+    if not call or call.metered_at or not call.end_time:
+        return None
+
+    now = now_datetime()
+    seconds = billable_seconds(call.answered_time, call.end_time)
+    minutes = math.ceil(seconds / 60)
+
+    consumed = []
+    if minutes:
+        # iba lookup – zúčtovanie nesmie zakladať BC Pouzivatel (napr. adminovi)
+        payer = _bc_user(call.advisor)
+        if payer:
+            consumed = _debit_tokens(payer, minutes, now)
+        _write_log(call, payer, seconds, consumed, now)
+
+    billed = sum(take for _, take, _ in consumed)
+    result = {
+        "billed_seconds": seconds,
+        "billed_minutes": billed,
+        "unbilled_minutes": minutes - billed,
+        "metered_at": now,
+    }
+    frappe.db.set_value("BC Call", call.name, result, update_modified=False)
+
+    metrics.incr("metering.calls")
+    metrics.incr("metering.minutes", billed)
+    if minutes > billed:
+        metrics.incr("metering.shortfall_minutes", minutes - billed)
+
+    result["tokens"] = [name for name, _, _ in consumed]
+    return result
+
+
+def _debit_tokens(payer: str, minutes: int, now) -> list[tuple[str, int, int]]:
+    """
+    Odpíše `minutes` z aktívnych tokenov platiteľa (najstarší ročník prvý).
+    Vracia [(token, odpísané minúty, nový zostatok)].
+    """
+    Token = frappe.qb.DocType("BC Token")
+    tokens = (
+        frappe.qb.from_(Token)
+        .select(Token.name, Token.minuty_ostavajuce, Token.vydany_rok)
+        .where(
+            (Token.aktualny_drzitel == payer)
+            & (Token.stav == "active")
+            & (Token.minuty_ostavajuce > 0)
+        )
+        .orderby(Token.vydany_rok)
+        .orderby(Token.creation)
+        .orderby(Token.name)
+        .for_update()
+        .run(as_dict=True)
+    )
+
+    consumed = []
+    remaining = minutes
+    for t in tokens:
+        if remaining <= 0:
+            break
+        take = min(int(t.minuty_ostavajuce), remaining)
+        consumed.append((t.name, take, int(t.minuty_ostavajuce) - take))
+        remaining -= take
+
+    if not consumed:
+        return consumed
+
+    left = Case()
+    for name, _, new_balance in consumed:
+        left = left.when(Token.name == name, new_balance)
+
+    update = (
+        frappe.qb.update(Token)
+        .set(Token.minuty_ostavajuce, left.else_(Token.minuty_ostavajuce))
+        .set(Token.modified, now)
+        .where(Token.name.isin([name for name, _, _ in consumed]))
+    )
+
+    exhausted = [name for name, _, new_balance in consumed if new_balance == 0]
+    if exhausted:
+        update = update.set(
+            Token.stav, Case().when(Token.name.isin(exhausted), "spent").else_(Token.stav)
+        )
+
+    update.run()
+
+    years = {t.name: t.vydany_rok for t in tokens}
+    for year in {years[name] for name in exhausted}:
+        n = sum(1 for name in exhausted if years[name] == year)
+        bump_supply(year, drzane=-n, spotrebovane=n)
+    return consumed
+
+
+def _bc_user(clerk_id: str | None) -> str | None:
+    return frappe.db.get_value("BC Pouzivatel", {"clerk_id": clerk_id}, "name") if clerk_id else None
+
+
+def _write_log(call, payer: str | None, seconds: int, consumed: list, now):
+    """
+    BC Dennik hovorov – jeden riadok na spotrebovaný token (čas hovoru rozdelený
+    po minútach) + riadok bez tokenu za nepokrytý zvyšok.
+    """
+    caller = _bc_user(call.caller)
+    start = get_datetime(call.answered_time)
+
+    rows = []
+    offset = 0
+
+    def add_row(token, length):
+        rows.append((
+            frappe.generate_hash(length=10),
+            now,
+            now,
+            frappe.session.user,
+            frappe.session.user,
+            caller,
+            payer,
+            add_to_date(start, seconds=offset),
+            add_to_date(start, seconds=offset + length),
+            length,
+            token,
+        ))
+
+    for token, take, _ in consumed:
+        length = min(take * 60, seconds - offset)
+        add_row(token, length)
+        offset += length
+
+    # časť hovoru nepokrytá tokenmi (alebo celý hovor) → záznam bez tokenu
+    if offset < seconds or not rows:
+        add_row(None, seconds - offset)
+
+    frappe.db.bulk_insert(
+        "BC Dennik hovorov",
+        fields=[
+            "name", "creation", "modified", "owner", "modified_by",
+            "volajuci", "poradca", "zaciatok", "koniec", "trvanie_s", "pouzity_token",
+        ],
+        values=rows,
+    )
@@ -0,0 +1,127 @@
+# apps/bcservices/bcservices/api/metrics.py
+
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+import frappe
+
+# ---------------------------------------------------
+# Per-worker counters & timings
+# ---------------------------------------------------
+#
+# Každý gunicorn / RQ worker si drží vlastné čísla v pamäti (bez Redis
+# round-tripu na hot path). Raz za FLUSH_INTERVAL sa snapshot odloží do
+# Redis cache, aby ich admin endpoint vedel spočítať naprieč workermi.
+
+FLUSH_INTERVAL = 15
+SNAPSHOT_TTL = 300
+_SAMPLES = 256
+
+_lock = threading.Lock()
+_counters: dict[str, int] = {}
+_timings: dict[str, dict] = {}
+_last_flush = {"ts": 0.0}
+
+
+def incr(name: str, n: int = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+    _maybe_flush()
+
+
+def observe(name: str, ms: float):
+    """Zaznamená trvanie (ms) – count / sum / max + posledných N vzoriek pre percentily."""
+    with _lock:
+        t = _timings.get(name)
+        if t is None:
+            t = _timings[name] = {"count": 0, "sum": 0.0, "max": 0.0, "samples": deque(maxlen=_SAMPLES)}
+        t["count"] += 1
+        t["sum"] += ms
+        t["max"] = max(t["max"], ms)
+        t["samples"].append(ms)
+    _maybe_flush()
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[idx]
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(_counters)
+        timings = {
+            k: {
+                "count": t["count"],
+                "avg": round(t["sum"] / t["count"], 3) if t["count"] else 0.0,
+                "max": round(t["max"], 3),
+                "p50": round(_percentile(t["samples"], 0.50), 3),
+                "p99": round(_percentile(t["samples"], 0.99), 3),
+            }
+            for k, t in _timings.items()
+        }
+    return {"counters": counters, "timings": timings}
+
+
+def _worker_key():
+    return f"bc_metrics:{socket.gethostname()}:{os.getpid()}"
+
+
+def _maybe_flush():
+    now = time.monotonic()
+    if now - _last_flush["ts"] < FLUSH_INTERVAL:
+        return
+    # mimo requestu / jobu (napr. v thread poole) nemáme frappe.local → flush necháme na neskôr
+    if not getattr(frappe.local, "site", None):
+        return
+    _last_flush["ts"] = now
+    flush()
+
+
+def flush():
+    try:
+        frappe.cache().set_value(_worker_key(), snapshot(), expires_in_sec=SNAPSHOT_TTL)
+    except Exception:
+        pass
+
+
+def collect() -> dict:
+    """
+    Súčet snapshotov všetkých živých workerov.
+    Percentily sa nedajú presne zlúčiť → vraciame max z workerov.
+    """
+    flush()
+
+    counters: dict[str, int] = {}
+    timings: dict[str, dict] = {}
+    workers = 0
+
+    cache = frappe.cache()
+    for key in cache.get_keys("bc_metrics:"):
+        key = key.decode() if isinstance(key, bytes) else key
+        snap = cache.get_value(key.split("|", 1)[-1])
+        if not snap:
+            continue
+        workers += 1
+
+        for k, v in (snap.get("counters") or {}).items():
+            counters[k] = counters.get(k, 0) + v
+
+        for k, t in (snap.get("timings") or {}).items():
+            agg = timings.setdefault(k, {"count": 0, "sum": 0.0, "max": 0.0, "p50": 0.0, "p99": 0.0})
+            agg["count"] += t["count"]
+            agg["sum"] += t["avg"] * t["count"]
+            agg["max"] = max(agg["max"], t["max"])
+            agg["p50"] = max(agg["p50"], t["p50"])
+            agg["p99"] = max(agg["p99"], t["p99"])
+
+    for agg in timings.values():
+        agg["avg"] = round(agg.pop("sum") / agg["count"], 3) if agg["count"] else 0.0
+
+    return {"workers": workers, "counters": counters, "timings": timings}
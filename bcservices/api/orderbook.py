@@ -0,0 +1,224 @@
+# apps/bcservices/bcservices/api/orderbook.py
+
+import time
+
+import frappe
+from frappe.utils import cint, flt, get_datetime
+
+from . import metrics
+from .utils import sql_table
+
+# ---------------------------------------------------
+# Order book sekundárneho trhu (price-time priority)
+# ---------------------------------------------------
+#
+# Otvorené listingy (asks) per ročník tokenu v Redis sorted sete:
+#   key    bc_orderbook:<rok>
+#   score  cena v centoch
+#   member "<creation v µs, 16 číslic>:<listing>"
+# Rovnaké score Redis radí lexikograficky podľa member → pri rovnakej cene
+# vyhráva starší listing. Best ask / N najlacnejších = ZRANGE 0..N-1,
+# O(log n + N). Hash bc_orderbook_members: listing → (rok, member) na
+# odstránenie bez skenu.
+#
+# Zdroj pravdy je DB: Redis sa mení až po commite (after_commit), kúpa
+# vždy zamyká a overuje riadky v DB, takže neaktuálny záznam v knihe nič
+# nepokazí – iba sa preskočí. Knihu ročníka vieme kedykoľvek postaviť
+# z DB (rebuild_order_book, hodinovo + lazy pri prázdnej Redis).
+
+BOOK_KEY = "bc_orderbook"
+MEMBERS_KEY = "bc_orderbook_members"
+BUILT_KEY = "bc_orderbook_built"
+# najmenšia stránka kandidátov, ktorú claim_asks číta z knihy naraz
+CLAIM_PAGE = 50
+
+
+def _book(year: int) -> str:
+    return frappe.cache().make_key(f"{BOOK_KEY}:{int(year)}")
+
+
+def _member(listing: str, created) -> str:
+    us = int(get_datetime(created).timestamp() * 1_000_000)
+    return f"{us:016d}:{listing}"
+
+
+def _cents(price) -> int:
+    return int(round(flt(price) * 100))
+
+
+# ---- zápis (volať v transakcii; Redis sa zmení až po commite) ----
+
+def add_ask(listing: str, year: int, price, created):
+    member = _member(listing, created)
+    frappe.db.after_commit.add(lambda: _add_now(listing, int(year), _cents(price), member))
+
+
+def remove_ask(listing: str):
+    frappe.db.after_commit.add(lambda: _remove_now(listing))
+
+
+def _add_now(listing: str, year: int, cents: int, member: str):
+    cache = frappe.cache()
+    cache.zadd(_book(year), {member: cents})
+    cache.hset(MEMBERS_KEY, listing, (year, member))
+
+
+def _remove_now(listing: str):
+    cache = frappe.cache()
+    entry = cache.hget(MEMBERS_KEY, listing)
+    if entry:
+        year, member = entry
+        cache.zrem(_book(year), member)
+    cache.hdel(MEMBERS_KEY, listing)
+
+
+# ---- čítanie ----
+
+def _ensure_book(year: int):
+    if not frappe.cache().get_value(f"{BUILT_KEY}:{int(year)}"):
+        rebuild_order_book(year)
+
+
+def cheapest(year: int, n: int, offset: int = 0) -> list[dict]:
+    """N najlacnejších asks (price-time priority), od pozície `offset`."""
+    if n <= 0:
+        return []
+    _ensure_book(year)
+    rows = frappe.cache().zrange(_book(year), int(offset), int(offset) + int(n) - 1, withscores=True)
+    return [{"listing": _listing(m), "priceEur": score / 100} for m, score in rows]
+
+
+def _listing(member) -> str:
+    member = member.decode() if isinstance(member, bytes) else member
+    return member.split(":", 1)[1]
+
+
+def best_ask(year: int) -> dict | None:
+    asks = cheapest(year, 1)
+    return asks[0] if asks else None
+
+
+def depth(year: int, levels: int = 10, scan: int = 1000) -> list[dict]:
+    """
+    Počet tokenov na cenových úrovniach od najlacnejšej. Číta najviac `scan`
+    najlacnejších asks (O(log n + scan)), nie celú knihu.
+    """
+    out: list[dict] = []
+    for ask in cheapest(year, scan):
+        if out and out[-1]["priceEur"] == ask["priceEur"]:
+            out[-1]["quantity"] += 1
+            continue
+        if len(out) == levels:
+            break
+        out.append({"priceEur": ask["priceEur"], "quantity": 1})
+    return out
+
+
+# ---- market order: kandidáti z knihy, zámok v DB ----
+
+def claim_asks(year: int, quantity: int, buyer: str, max_price: float | None = None) -> list[str]:
+    """
+    Zamkne `quantity` najlacnejších otvorených listingov ročníka (cudzích,
+    voliteľne do `max_price`) a vráti ich mená v price-time poradí.
+    Kandidátov berie z knihy po stránkach, kým nezamkne dosť riadkov alebo
+    kniha neskončí; DB ich overí (stav, predávajúci, cena) a SKIP LOCKED
+    preskočí neaktuálne, vlastné aj práve kupované inými.
+    """
+    page = max(int(quantity) * 2, CLAIM_PAGE)
+    names: list[str] = []
+    offset = 0
+
+    while len(names) < quantity:
+        asks = cheapest(year, page, offset)
+        offset += len(asks)
+
+        # kniha je zoradená podľa ceny → drahšie už netreba čítať
+        candidates = [a["listing"] for a in asks if max_price is None or a["priceEur"] <= max_price]
+        if candidates:
+            names += _lock_asks(candidates, buyer, quantity - len(names), max_price)
+
+        if len(asks) < page or len(candidates) < len(asks):
+            break
+
+    if len(names) < quantity:
+        metrics.incr("orderbook.insufficient")
+        frappe.throw("Not enough listings in order book", frappe.ValidationError)
+
+    metrics.incr("orderbook.market_filled", len(names))
+    return names
+
+
+def _lock_asks(candidates: list[str], buyer: str, limit: int, max_price: float | None) -> list[str]:
+    return frappe.db.sql(
+        f"""
+        select name
+        from {sql_table("BC Inzerat")}
+        where name in %(candidates)s
+            and stav = 'open'
+            and predavajuci != %(buyer)s
+            {"and cena_eur <= %(max_price)s" if max_price is not None else ""}
+        order by cena_eur asc, creation asc, name asc
+        limit %(limit)s
+        for update skip locked
+        """,
+        {
+            "candidates": tuple(candidates),
+            "buyer": buyer,
+            "max_price": max_price,
+            "limit": int(limit),
+        },
+        pluck=True,
+    )
+
+
+# ---- rebuild z DB ----
+
+def rebuild_order_book(year: int | None = None):
+    """
+    Postaví knihu (jedného alebo všetkých ročníkov) z otvorených BC Inzerat.
+    Bench: bench --site <site> execute bcservices.api.orderbook.rebuild_order_book
+    """
+    Listing = frappe.qb.DocType("BC Inzerat")
+    Token = frappe.qb.DocType("BC Token")
+    q = (
+        frappe.qb.from_(Listing)
+        .join(Token)
+        .on(Token.name == Listing.token)
+        .select(Listing.name, Listing.cena_eur, Listing.creation, Token.vydany_rok)
+        .where(Listing.stav == "open")
+    )
+    if year:
+        q = q.where(Token.vydany_rok == int(year))
+
+    books: dict[int, dict] = {}
+    for r in q.run(as_dict=True):
+        books.setdefault(cint(r.vydany_rok), {})[r.name] = (_member(r.name, r.creation), _cents(r.cena_eur))
+
+    cache = frappe.cache()
+    years = [int(year)] if year else sorted(set(books) | _known_years())
+    if not year:
+        cache.delete_value(MEMBERS_KEY)
+
+    for y in years:
+        asks = books.get(y, {})
+        pipe = cache.pipeline()
+        pipe.delete(_book(y))
+        if asks:
+            pipe.zadd(_book(y), {member: cents for member, cents in asks.values()})
+        pipe.execute()
+
+        for listing, (member, _) in asks.items():
+            cache.hset(MEMBERS_KEY, listing, (y, member))
+        cache.set_value(f"{BUILT_KEY}:{y}", int(time.time()))
+
+    metrics.incr("orderbook.rebuilds")
+    return {y: len(books.get(y, {})) for y in years}
+
+
+def _known_years() -> set[int]:
+    """Ročníky, ktoré už majú knihu v Redis (aby full rebuild vyčistil aj prázdne)."""
+    years = set()
+    for key in frappe.cache().get_keys(f"{BUILT_KEY}:"):
+        key = key.decode() if isinstance(key, bytes) else key
+        years.add(cint(key.rsplit(":", 1)[-1]))
+    return years
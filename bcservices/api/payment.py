@@ -10,8 +10,13 @@ from .utils import (
     ensure_bc_user_by_clerk,
     ensure_settings
 )
+from .treasury import claim_treasury_tokens, assign_tokens, insert_purchase_items, bump_supply
+from .orderbook import remove_ask
 
 stripe.api_key = frappe.conf.get("stripe_secret_key")
+# lokálny mock (bcservices.devtools.mock_stripe)
+if frappe.conf.get("stripe_api_base"):
+    stripe.api_base = frappe.conf.get("stripe_api_base")
 
 # -----------------------------------------------------------------------------
 # CHECKOUT – TREASURY
@@ -214,7 +219,13 @@ def stripe_webhook():
         meta = session.get("metadata") or {}
         payment_id = meta.get("paymentId")
 
+        # Stripe webhook môže prísť viackrát (retry) → platbu zamkneme a
+        # fulfillment spravíme iba pri prechode pending → paid
         if payment_id:
+            stav = frappe.db.get_value("BC Platba", payment_id, "stav", for_update=True)
+            if stav == "paid":
+                return {"received": True, "duplicate": True}
+
             frappe.db.set_value(
                 "BC Platba",
                 payment_id,
@@ -230,6 +241,7 @@ def stripe_webhook():
                 buyer_clerk_id=meta.get("buyerId"),
                 quantity=int(meta.get("quantity") or 0),
                 year=int(meta.get("year") or now_datetime().year),
+                payment_id=payment_id,
             )
 
         # Marketplace listing purchase
@@ -256,48 +268,24 @@ def stripe_webhook():
 # FULFILLMENT HELPERS
 # -----------------------------------------------------------------------------
 
-def _fulfill_treasury(buyer_clerk_id: str, quantity: int, year: int):
+def _fulfill_treasury(buyer_clerk_id: str, quantity: int, year: int, payment_id: str | None = None):
     """Assign newly purchased treasury tokens to the buyer."""
-    user = ensure_bc_user_by_clerk(buyer_clerk_id)
-
-    tokens = frappe.get_all(
-        "BC Token",
-        filters={
-            "aktualny_drzitel": ["is", "null"],
-            "vydany_rok": year,
-            "stav": "active",
-        },
-        fields=["name"],
-        order_by="creation asc",
-        limit_page_length=quantity,
-    )
-
-    if len(tokens) < quantity:
-        frappe.throw("Treasury sold out", frappe.ValidationError)
+    # poškodené / podvrhnuté metadata → nič na pridelenie (a žiadne delenie nulou)
+    if quantity <= 0:
+        frappe.log_error(f"Treasury fulfillment without quantity (payment {payment_id})", "BC Stripe")
+        return
 
-    names = [t["name"] for t in tokens]
+    user = ensure_bc_user_by_clerk(buyer_clerk_id)
 
-    # Assign tokens
-    for token_name in names:
-        frappe.db.set_value("BC Token", token_name, "aktualny_drzitel", user.name)
+    names = claim_treasury_tokens(quantity, year)
 
-    # Create purchase items (optional)
-    settings = ensure_settings()
-    unit_price = float(settings.aktualna_cena_eur or 0)
+    # Assign tokens – jeden UPDATE pre všetky tokeny
+    assign_tokens(names, user.name, year)
 
-    for token_name in names:
-        try:
-            item = frappe.get_doc(
-                {
-                    "doctype": "BC Polozka Nakupu",
-                    "token": token_name,
-                    "jednotkova_cena_eur": unit_price,
-                    "rok": year,
-                }
-            )
-            item.insert(ignore_permissions=True)
-        except Exception:
-            pass
+    # Purchase items ako child riadky platby (BC Platba.polozky)
+    if payment_id and names:
+        unit_price = float(frappe.db.get_value("BC Platba", payment_id, "suma_eur") or 0) / len(names)
+        insert_purchase_items(payment_id, names, unit_price, year)
 
 
 def _fulfill_listing(buyer_clerk_id: str, listing_id: str):
@@ -314,6 +302,7 @@ def _fulfill_listing(buyer_clerk_id: str, listing_id: str):
         lst.name,
         {"stav": "sold", "uzavrete_kedy": now_datetime()}
     )
+    remove_ask(lst.name)
 
     tok = frappe.get_doc("BC Token", lst.token)
 
@@ -330,6 +319,7 @@ def _fulfill_listing(buyer_clerk_id: str, listing_id: str):
         tok.name,
         {"aktualny_drzitel": buyer.name, "stav": "active"}
     )
+    bump_supply(tok.vydany_rok, na_predaj=-1, drzane=1)
 
     # Create trade record
     trade = frappe.get_doc(
@@ -3,6 +3,8 @@
 import frappe
 from frappe.utils import now_datetime
 from .utils import ensure_settings
+from .treasury import get_supply
+from .http_cache import cached_json
 
 @frappe.whitelist(methods=["GET"], allow_guest=True)
 def supply(year: int = None):
@@ -14,43 +16,27 @@ def supply(year: int = None):
     - koľko tokenov je v treasury (voľné)
     - koľko tokenov bolo vydaných pre daný rok
     - koľko z nich je už predaných / držaných používateľmi
+
+    Odpoveď je verzovaná (ETag / 304, Cache-Control pre CDN).
     """
 
     y = int(year or now_datetime().year)
+    return cached_json("supply", {"year": y}, lambda: _supply(y))
+
+
+def _supply(y: int) -> dict:
     settings = ensure_settings()
 
-    # Treasury (voľné tokeny)
-    treasury_tokens = frappe.get_all(
-        "BC Token",
-        filters={
-            "aktualny_drzitel": ["is", "null"],
-            "stav": "active",
-            "vydany_rok": y,
-        },
-        pluck="name"
-    )
-
-    # Total minted (všetky tokeny pre daný rok)
-    minted = frappe.db.count(
-        "BC Token",
-        {
-            "vydany_rok": y,
-        }
-    )
-
-    # Total sold (tokeny, ktoré už majú držiteľa)
-    sold = frappe.db.count(
-        "BC Token",
-        {
-            "vydany_rok": y,
-            "aktualny_drzitel": ["is", "set"],
-        }
-    )
+    # materializované počty (BC Zasoba Tokenov) – jeden dotaz namiesto skenu BC Token
+    counts = get_supply(y)
 
     return {
         "year": y,
         "priceEur": float(settings.aktualna_cena_eur or 0),
-        "treasuryAvailable": len(treasury_tokens),
-        "totalMinted": minted,
-        "totalSold": sold
+        "treasuryAvailable": counts["v_treasury"],
+        "totalMinted": counts["vydane"],
+        "totalSold": counts["vydane"] - counts["v_treasury"],
+        "held": counts["drzane"],
+        "listed": counts["na_predaj"],
+        "spent": counts["spotrebovane"]
     }
@@ -0,0 +1,82 @@
+# apps/bcservices/bcservices/api/realtime.py
+
+import hmac
+import hashlib
+
+import frappe
+from frappe.utils.password import get_encryption_key
+
+from . import metrics
+from .utils import verify_clerk_bearer_and_get_sub
+
+# ---------------------------------------------------
+# Realtime kanály per Clerk user (Frappe socket.io)
+# ---------------------------------------------------
+#
+# Clerk useri nie sú Frappe useri (socket je Guest), takže room `user:<name>`
+# nepoužijeme. Každý Clerk user má vlastný kanál = Frappe task room
+# `task_progress:<channel>`, kam sa klient prihlási štandardným
+# `socket.emit("task_subscribe", channel)`. Channel je HMAC zo site
+# encryption key → nedá sa uhádnuť z clerk_id.
+#
+# iOS / admin app:
+#   GET /api/method/bcservices.api.realtime.channel → {"channel", "events"}
+#   socket.emit("task_subscribe", channel)
+#   socket.on("bc_call_state", ...)
+
+CALL_STATE_EVENT = "bc_call_state"
+
+CALL_STATE_FIELDS = [
+    "name", "caller", "advisor", "status",
+    "start_time", "answered_time", "end_time", "billed_minutes",
+]
+
+
+def user_channel(clerk_id: str) -> str:
+    key = get_encryption_key().encode()
+    return hmac.new(key, f"bc_user:{clerk_id}".encode(), hashlib.sha256).hexdigest()[:40]
+
+
+def publish_to_user(clerk_id: str, event: str, message: dict):
+    """Odošle event na kanál usera až po commite transakcie (rollback → nič neodíde)."""
+    if not clerk_id:
+        return
+    # room priamo, nie task_id= – s task_id publish_realtime vypne after_commit
+    frappe.publish_realtime(event, message, room=f"task_progress:{user_channel(clerk_id)}", after_commit=True)
+    metrics.incr(f"realtime.{event}")
+
+
+def publish_call_state(call: str | dict):
+    """Aktuálny stav BC Call → volajúcemu aj prijímateľovi."""
+    if isinstance(call, str):
+        call = frappe.db.get_value("BC Call", call, CALL_STATE_FIELDS, as_dict=True)
+    if not call:
+        return
+
+    message = {
+        "callId": call["name"],
+        "status": call["status"],
+        "callerId": call["caller"],
+        "advisorId": call["advisor"],
+        "startTime": call.get("start_time"),
+        "answeredTime": call.get("answered_time"),
+        "endTime": call.get("end_time"),
+        "billedMinutes": call.get("billed_minutes"),
+    }
+    for clerk_id in {call["caller"], call["advisor"]}:
+        publish_to_user(clerk_id, CALL_STATE_EVENT, message)
+
+
+@frappe.whitelist(methods=["GET"], allow_guest=True)
+def channel():
+    """
+    iOS → /api/method/bcservices.api.realtime.channel
+    Vráti realtime kanál prihláseného Clerk usera.
+    """
+    clerk_id, payload = verify_clerk_bearer_and_get_sub()
+    return {
+        "success": True,
+        "channel": user_channel(clerk_id),
+        "subscribe": "task_subscribe",
+        "events": [CALL_STATE_EVENT],
+    }
@@ -0,0 +1,182 @@
+# apps/bcservices/bcservices/api/stats.py
+
+import hashlib
+
+import frappe
+from frappe.utils import getdate, get_first_day, cint
+
+from .utils import verify_clerk_bearer_and_get_sub, get_clerk_role, upsert_counters
+
+# ---------------------------------------------------
+# Rollup štatistík hovorov (BC Statistika Hovorov)
+# ---------------------------------------------------
+#
+# Jeden riadok = (user, rola v hovore, obdobie day/month, začiatok obdobia).
+# Pri každom ukončenom hovore (ended / missed / declined) sa v tej istej
+# transakcii pripočítajú 4 riadky (caller + advisor × day + month) jedným
+# INSERT ... ON DUPLICATE KEY UPDATE. Čítanie je O(počet bucketov).
+#
+# Backfill / oprava: bench --site <site> execute bcservices.api.stats.rebuild_call_stats
+
+STATS_DOCTYPE = "BC Statistika Hovorov"
+PERIODS = ("day", "month")
+COUNTERS = ("pocet_hovorov", "prijate_hovory", "trvanie_s", "uctovane_minuty")
+
+
+def _bucket_name(clerk_id: str, role: str, period: str, start) -> str:
+    # deterministický name → upsert cez primárny kľúč
+    key = f"{clerk_id}|{role}|{period}|{start}"
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def _buckets(call) -> list[tuple]:
+    """Riadky (name, user, rola, obdobie, začiatok, *počítadlá) pre jeden ukončený hovor."""
+    day = getdate(call.get("start_time") or call.get("end_time"))
+    counters = (
+        1,
+        1 if call.get("answered_time") else 0,
+        cint(call.get("billed_seconds")),
+        cint(call.get("billed_minutes")),
+    )
+
+    rows = []
+    for role in ("caller", "advisor"):
+        clerk_id = call.get(role)
+        if not clerk_id:
+            continue
+        for period, start in (("day", day), ("month", get_first_day(day))):
+            rows.append((_bucket_name(clerk_id, role, period, start), clerk_id, role, period, start, *counters))
+    return rows
+
+
+def record_call(call):
+    """Pripočíta ukončený hovor do rollupu (volať v transakcii, ktorá hovor ukončila)."""
+    rows = _buckets(call)
+    if rows:
+        _upsert(rows)
+
+
+def _upsert(rows: list[tuple]):
+    upsert_counters(
+        STATS_DOCTYPE,
+        ["name", "pouzivatel", "rola", "obdobie", "zaciatok_obdobia", *COUNTERS],
+        rows,
+        COUNTERS,
+    )
+
+
+def rebuild_call_stats(since: str | None = None, chunk: int = 5000):
+    """
+    Prepočíta rollup z BC Call (všetko, alebo od mesiaca, v ktorom je `since`).
+    Hovory sa čítajú po dávkach (keyset na name), buckety sa sčítajú v pamäti.
+    """
+    since = get_first_day(getdate(since)) if since else None
+
+    if since:
+        frappe.db.delete(STATS_DOCTYPE, {"zaciatok_obdobia": [">=", since]})
+    else:
+        frappe.db.delete(STATS_DOCTYPE)
+
+    Call = frappe.qb.DocType("BC Call")
+    totals: dict[str, list] = {}
+    last = ""
+
+    while True:
+        q = (
+            frappe.qb.from_(Call)
+            .select(
+                Call.name, Call.caller, Call.advisor, Call.start_time, Call.end_time,
+                Call.answered_time, Call.billed_seconds, Call.billed_minutes,
+            )
+            .where(Call.status.isin(["ended", "missed", "declined"]))
+            .where(Call.name > last)
+            .orderby(Call.name)
+            .limit(chunk)
+        )
+        if since:
+            q = q.where(Call.start_time >= since)
+
+        calls = q.run(as_dict=True)
+        if not calls:
+            break
+
+        for call in calls:
+            for row in _buckets(call):
+                acc = totals.get(row[0])
+                if acc is None:
+                    totals[row[0]] = list(row)
+                    continue
+                for i in range(5, 5 + len(COUNTERS)):
+                    acc[i] += row[i]
+        last = calls[-1].name
+
+    rows = [tuple(r) for r in totals.values()]
+    for i in range(0, len(rows), 500):
+        _upsert(rows[i : i + 500])
+
+    frappe.db.commit()
+    return {"buckets": len(rows)}
+
+
+# ---------------------------------------------------
+# Read API
+# ---------------------------------------------------
+
+@frappe.whitelist(methods=["GET"], allow_guest=True)
+def calls(userId: str = None, period: str = "day", since: str = None, until: str = None, role: str = None):
+    """
+    iOS / admin → /api/method/bcservices.api.stats.calls?userId=&period=day|month&since=&until=&role=
+    Klient vidí iba seba, admin kohokoľvek.
+    """
+    clerk_id, payload = verify_clerk_bearer_and_get_sub()
+    userId = userId or clerk_id
+
+    if userId != clerk_id and get_clerk_role(clerk_id, payload) != "admin":
+        frappe.throw("Forbidden", frappe.PermissionError)
+    if period not in PERIODS:
+        frappe.throw("Invalid period", frappe.ValidationError)
+
+    filters = {"pouzivatel": userId, "obdobie": period}
+    if role:
+        filters["rola"] = role
+    if since and until:
+        filters["zaciatok_obdobia"] = ["between", [getdate(since), getdate(until)]]
+    elif since:
+        filters["zaciatok_obdobia"] = [">=", getdate(since)]
+    elif until:
+        filters["zaciatok_obdobia"] = ["<=", getdate(until)]
+
+    rows = frappe.get_all(
+        STATS_DOCTYPE,
+        filters=filters,
+        fields=["zaciatok_obdobia", "rola", *COUNTERS],
+        order_by="zaciatok_obdobia asc",
+    )
+
+    buckets = [
+        {
+            "start": r.zaciatok_obdobia,
+            "role": r.rola,
+            "calls": r.pocet_hovorov,
+            "answeredCalls": r.prijate_hovory,
+            "talkSeconds": r.trvanie_s,
+            "billedMinutes": r.uctovane_minuty,
+            "avgDurationSeconds": round(r.trvanie_s / r.prijate_hovory, 1) if r.prijate_hovory else 0,
+        }
+        for r in rows
+    ]
+
+    answered = sum(b["answeredCalls"] for b in buckets)
+    talk = sum(b["talkSeconds"] for b in buckets)
+    return {
+        "success": True,
+        "period": period,
+        "buckets": buckets,
+        "totals": {
+            "calls": sum(b["calls"] for b in buckets),
+            "answeredCalls": answered,
+            "talkSeconds": talk,
+            "billedMinutes": sum(b["billedMinutes"] for b in buckets),
+            "avgDurationSeconds": round(talk / answered, 1) if answered else 0,
+        },
+    }
@@ -0,0 +1,230 @@
+# apps/bcservices/bcservices/api/treasury.py
+
+import random
+
+import frappe
+from frappe.query_builder.functions import Sum
+from frappe.utils import now_datetime, cint
+
+from . import metrics
+from .http_cache import bump_market_version
+from .utils import sql_table, upsert_counters
+
+# ---------------------------------------------------
+# Treasury – alokácia voľných tokenov (piatkové dropy)
+# ---------------------------------------------------
+#
+# Voľný token = BC Token bez držiteľa, stav "active", daného ročníka.
+# Súbežní kupujúci si riadky zamykajú cez SELECT ... FOR UPDATE SKIP LOCKED:
+# každý dostane iné (nezamknuté) tokeny, nikto nečaká na jeden „horúci“
+# riadok a ten istý token sa nepredá dvakrát. Zámky drží transakcia
+# requestu / webhooku až do commitu (rollback ich uvoľní).
+#
+# Index (vydany_rok, stav, aktualny_drzitel, creation) – patch
+# add_bc_token_treasury_index – robí z výberu krátky range scan.
+
+
+def claim_treasury_tokens(quantity: int, year: int) -> list[str]:
+    """
+    Zamkne `quantity` najstarších voľných tokenov ročníka `year` a vráti ich mená.
+    Ak ich nie je dosť, vyhodí ValidationError (zámky uvoľní rollback).
+    """
+    names = frappe.db.sql(
+        f"""
+        select name
+        from {sql_table("BC Token")}
+        where vydany_rok = %(year)s
+            and stav = 'active'
+            and aktualny_drzitel is null
+        order by creation asc
+        limit %(quantity)s
+        for update skip locked
+        """,
+        {"year": int(year), "quantity": int(quantity)},
+        pluck=True,
+    )
+
+    if len(names) < quantity:
+        metrics.incr("treasury.sold_out")
+        frappe.throw("Not enough tokens in treasury", frappe.ValidationError)
+
+    metrics.incr("treasury.claimed", len(names))
+    return names
+
+
+def assign_tokens(names: list[str], holder: str, year: int):
+    """
+    Prevedie zamknuté treasury tokeny (ročník `year`) na držiteľa jedným
+    UPDATE-om (namiesto set_value per token).
+    """
+    if not names:
+        return
+
+    Token = frappe.qb.DocType("BC Token")
+    (
+        frappe.qb.update(Token)
+        .set(Token.aktualny_drzitel, holder)
+        .set(Token.modified, now_datetime())
+        .where(Token.name.isin(names))
+        .where(Token.aktualny_drzitel.isnull())
+    ).run()
+
+    bump_supply(year, v_treasury=-len(names), drzane=len(names))
+
+
+def insert_purchase_items(payment: str, names: list[str], unit_price: float, year: int):
+    """
+    Položky nákupu ako child riadky BC Platba.polozky – jeden multi-row INSERT.
+    """
+    if not names:
+        return
+
+    now = now_datetime()
+    user = frappe.session.user
+    start = cint(frappe.db.count("BC Polozka Nakupu", {"parent": payment, "parenttype": "BC Platba"}))
+    docstatus = cint(frappe.db.get_value("BC Platba", payment, "docstatus"))
+
+    frappe.db.bulk_insert(
+        "BC Polozka Nakupu",
+        fields=[
+            "name", "creation", "modified", "owner", "modified_by", "docstatus",
+            "parent", "parenttype", "parentfield", "idx",
+            "token", "jednotkova_cena_eur", "rok",
+        ],
+        values=[
+            (
+                frappe.generate_hash(length=10), now, now, user, user, docstatus,
+                payment, "BC Platba", "polozky", start + i,
+                token, unit_price, year,
+            )
+            for i, token in enumerate(names, start=1)
+        ],
+    )
+
+
+# ---------------------------------------------------
+# Materializované počty tokenov per ročník (BC Zasoba Tokenov)
+# ---------------------------------------------------
+#
+# vydane       – všetky tokeny ročníka
+# v_treasury   – bez držiteľa, active
+# drzane       – s držiteľom, active
+# na_predaj    – listed
+# spotrebovane – spent
+#
+# Každý zápis (mint, nákup, listing, predaj, účtovanie hovoru) pripočíta
+# delty v tej istej transakcii. Ročník má `supply_counter_shards` riadkov
+# (default 8) a zápis ide do náhodného z nich. Jeden riadok na ročník by
+# držal zámok až do commitu každého nákupu → súbežné SKIP LOCKED nákupy
+# by sa na ňom opäť serializovali. Čítanie = jeden SUM nad ≤ 8 riadkami
+# z indexu na `rok` (prakticky rovnako lacné ako jeden riadok).
+#
+# Rekonciliácia (scheduler, denne): reconcile_supply – per ročník zamkne
+# všetky shardy (chýbajúce založí), až potom počíta z BC Token a prepíše ich.
+
+SUPPLY_DOCTYPE = "BC Zasoba Tokenov"
+SUPPLY_COUNTERS = ("vydane", "v_treasury", "drzane", "na_predaj", "spotrebovane")
+
+
+def _shards() -> int:
+    return max(1, cint(frappe.conf.get("supply_counter_shards") or 8))
+
+
+def bump_supply(year: int, **deltas):
+    """Pripočíta delty (napr. v_treasury=-3, drzane=3) k počtom ročníka."""
+    deltas = {k: int(v) for k, v in deltas.items() if v}
+    if not deltas or not year:
+        return
+
+    unknown = set(deltas) - set(SUPPLY_COUNTERS)
+    if unknown:
+        raise ValueError(f"Unknown supply counters: {unknown}")
+
+    shard = random.randrange(_shards())
+    _upsert_supply([(int(year), shard, *(deltas.get(c, 0) for c in SUPPLY_COUNTERS))])
+
+    # každá zmena zásoby mení aj verejné supply / listings
+    bump_market_version()
+
+
+def _upsert_supply(rows: list[tuple]):
+    """rows = (rok, shard, *SUPPLY_COUNTERS); name riadku = "<rok>-<shard>"."""
+    upsert_counters(
+        SUPPLY_DOCTYPE,
+        ["name", "rok", "shard", *SUPPLY_COUNTERS],
+        [(f"{r[0]}-{r[1]}", *r) for r in rows],
+        SUPPLY_COUNTERS,
+    )
+
+
+def get_supply(year: int) -> dict:
+    """Súčet shardov ročníka – jeden dotaz."""
+    Supply = frappe.qb.DocType(SUPPLY_DOCTYPE)
+    row = (
+        frappe.qb.from_(Supply)
+        .select(*(Sum(Supply[c]).as_(c) for c in SUPPLY_COUNTERS))
+        .where(Supply.rok == int(year))
+    ).run(as_dict=True)
+
+    row = row[0] if row else {}
+    return {c: cint(row.get(c)) for c in SUPPLY_COUNTERS}
+
+
+def reconcile_supply():
+    """
+    Prepočíta BC Zasoba Tokenov z BC Token, každý ročník vo vlastnej transakcii.
+    """
+    Supply = frappe.qb.DocType(SUPPLY_DOCTYPE)
+    Token = frappe.qb.DocType("BC Token")
+    years = set(
+        frappe.qb.from_(Token).select(Token.vydany_rok).distinct()
+        .where(Token.vydany_rok.isnotnull()).run(pluck=True)
+    ) | set(frappe.qb.from_(Supply).select(Supply.rok).distinct().run(pluck=True))
+
+    # snapshot z výberu ročníkov nesmie ostať pre počítanie
+    frappe.db.commit()
+
+    for year in sorted(cint(y) for y in years):
+        _reconcile_year(year)
+        frappe.db.commit()
+
+    return {"years": len(years)}
+
+
+def _reconcile_year(year: int):
+    """
+    1. upsert nulových delt do všetkých shardov ročníka → riadky existujú
+       a sú zamknuté; bump_supply počká (a nemôže založiť nový riadok mimo zámku)
+    2. počty z BC Token – až po zámkoch, takže vidia každý commitnutý zápis;
+       nekommitnuté zápisy pripočítajú svoje delty až na prepočítaný stav
+    3. shard 0 = počty, ostatné shardy = 0
+    """
+    _upsert_supply([(year, shard, *([0] * len(SUPPLY_COUNTERS))) for shard in range(_shards())])
+    frappe.db.sql(f"select name from {sql_table(SUPPLY_DOCTYPE)} where rok = %s for update", year)
+
+    counts = frappe.db.sql(
+        f"""
+        select
+            count(*),
+            sum(case when stav = 'active' and aktualny_drzitel is null then 1 else 0 end),
+            sum(case when stav = 'active' and aktualny_drzitel is not null then 1 else 0 end),
+            sum(case when stav = 'listed' then 1 else 0 end),
+            sum(case when stav = 'spent' then 1 else 0 end)
+        from {sql_table("BC Token")}
+        where vydany_rok = %s
+        """,
+        year,
+    )[0]
+
+    Supply = frappe.qb.DocType(SUPPLY_DOCTYPE)
+    reset = frappe.qb.update(Supply).where(Supply.rok == year)
+    for c in SUPPLY_COUNTERS:
+        reset = reset.set(Supply[c], 0)
+    reset.run()
+
+    totals = frappe.qb.update(Supply).set(Supply.modified, now_datetime()).where(Supply.name == f"{year}-0")
+    for c, value in zip(SUPPLY_COUNTERS, counts):
+        totals = totals.set(Supply[c], cint(value))
+    totals.run()
+
+    bump_market_version()
@@ -1,11 +1,16 @@
 # apps/bcservices/bcservices/api/utils.py
 
-import json, time
+import os, json, time, random, threading, hashlib, base64
+from email.utils import parsedate_to_datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 import frappe
 import jwt
 import requests
-from jwt import PyJWKClient
-from frappe.utils import now_datetime, cint, flt
+import requests.adapters
+from frappe.utils import now_datetime, cint, flt, add_to_date, get_datetime
+
+from . import metrics
 
 # ---------------------------------------------------
 # Clerk helpers
@@ -25,16 +30,193 @@ def _clerk_secret():
     return key
 
 
+class JWKSKeyStore:
+    """
+    Zdieľaný (per-worker) store verejných kľúčov Clerka indexovaný podľa `kid`.
+
+    - kľúče sa parsujú iba raz, pri fetchi JWKS dokumentu
+    - pred expiráciou sa obnovia na pozadí (request nečaká)
+    - neznámy `kid` vyvolá refetch najviac raz za `min_refetch_interval` s,
+      takže záplava zlých tokenov nespôsobí fetch storm
+    """
+
+    def __init__(self, url: str, ttl: int = 3600, refresh_ahead: int = 300, min_refetch_interval: int = 30):
+        self.url = url
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.min_refetch_interval = min_refetch_interval
+
+        self._keys: dict[str, jwt.PyJWK] = {}
+        self._fetched_at = 0.0
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self.stats = {"hits": 0, "misses": 0, "fetches": 0, "fetch_errors": 0, "rate_limited": 0}
+
+    def _count(self, name: str):
+        self.stats[name] += 1
+        metrics.incr(f"jwks.{name}")
+
+    def _fetch(self):
+        self._last_attempt = time.monotonic()
+        self._count("fetches")
+        try:
+            resp = requests.get(self.url, timeout=(3, 5))
+            resp.raise_for_status()
+            jwk_set = jwt.PyJWKSet.from_dict(resp.json())
+        except Exception:
+            self._count("fetch_errors")
+            raise
+
+        self._keys = {k.key_id: k for k in jwk_set.keys if k.key_id}
+        self._fetched_at = time.monotonic()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                self._fetch()
+        except Exception:
+            pass
+        finally:
+            self._refreshing = False
+
+    def get_signing_key(self, kid: str) -> jwt.PyJWK:
+        age = time.monotonic() - self._fetched_at
+
+        # kľúče sú ešte platné, ale blíži sa expirácia → refresh na pozadí
+        if self._keys and self.ttl - self.refresh_ahead <= age < self.ttl and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._background_refresh, daemon=True).start()
+
+        key = self._keys.get(kid) if age < self.ttl else None
+        if key is not None:
+            self._count("hits")
+            return key
+
+        self._count("misses")
+
+        with self._lock:
+            # medzitým mohol kľúče stiahnuť iný thread
+            age = time.monotonic() - self._fetched_at
+            key = self._keys.get(kid) if age < self.ttl else None
+            if key is not None:
+                return key
+
+            if time.monotonic() - self._last_attempt >= self.min_refetch_interval:
+                try:
+                    self._fetch()
+                except Exception:
+                    # Clerk JWKS nedostupné → radšej staré kľúče ako odmietnuť všetky tokeny
+                    if kid not in self._keys:
+                        raise
+            else:
+                self._count("rate_limited")
+
+        key = self._keys.get(kid)
+        if key is None:
+            raise jwt.PyJWKClientError(f'Unable to find a signing key that matches: "{kid}"')
+        return key
+
+    def get_signing_key_from_jwt(self, token: str) -> jwt.PyJWK:
+        header = jwt.get_unverified_header(token)
+        return self.get_signing_key(header.get("kid"))
+
+
+_jwks_stores: dict[str, JWKSKeyStore] = {}
+_jwks_stores_lock = threading.Lock()
+
+
 def _jwks_client():
     """
-    JWKS je cache-ované, aby sa nemusel sťahovať pri každom requeste.
+    JWKS store je zdieľaný v rámci workera (jeden na issuer URL),
+    takže sa JWKS nesťahuje ani neparsuje pri každom requeste.
     """
-    cache_key = "bc_jwks_url"
-    url = frappe.cache().get_value(cache_key)
-    if not url:
-        url = f"{_clerk_issuer()}/.well-known/jwks.json"
-        frappe.cache().set_value(cache_key, url, expires_in_sec=3600)
-    return PyJWKClient(url)
+    url = f"{_clerk_issuer()}/.well-known/jwks.json"
+    store = _jwks_stores.get(url)
+    if store is None:
+        with _jwks_stores_lock:
+            store = _jwks_stores.get(url)
+            if store is None:
+                store = _jwks_stores[url] = JWKSKeyStore(
+                    url,
+                    ttl=cint(frappe.conf.get("clerk_jwks_ttl") or 3600),
+                    refresh_ahead=cint(frappe.conf.get("clerk_jwks_refresh_ahead") or 300),
+                    min_refetch_interval=cint(frappe.conf.get("clerk_jwks_min_refetch_interval") or 30),
+                )
+    return store
+
+
+def jwks_stats():
+    return {url: dict(store.stats) for url, store in _jwks_stores.items()}
+
+
+class VerifiedTokenCache:
+    """
+    LRU cache overených Clerk JWT: sha256(tokenu) → (sub, payload).
+    Položka platí do `exp` tokenu, počet položiek na worker je obmedzený.
+    """
+
+    def __init__(self, max_entries: int = 2048):
+        self.max_entries = max_entries
+        self._items: OrderedDict[str, tuple] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: str):
+        with self._lock:
+            item = self._items.get(digest)
+            if item is None:
+                return None
+
+            sub, payload = item
+            if (payload.get("exp") or 0) <= time.time():
+                del self._items[digest]
+                return None
+
+            self._items.move_to_end(digest)
+            return sub, payload
+
+    def put(self, digest: str, sub: str, payload: dict):
+        if not payload.get("exp"):
+            return
+
+        with self._lock:
+            self._items[digest] = (sub, payload)
+            self._items.move_to_end(digest)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_verified_tokens = VerifiedTokenCache()
+
+
+def _shared_verify_cache() -> bool:
+    """Zdieľanie overených tokenov medzi workermi cez Redis (default zapnuté)."""
+    return cint(frappe.conf.get("clerk_verify_cache_shared", 1)) == 1
+
+
+def _shared_verified_get(digest: str):
+    try:
+        hit = frappe.cache().get_value(f"bc_jwt:{digest}")
+    except Exception:
+        return None
+
+    if not hit or (hit[1].get("exp") or 0) <= time.time():
+        return None
+    return tuple(hit)
+
+
+def _shared_verified_set(digest: str, sub: str, payload: dict):
+    ttl = int((payload.get("exp") or 0) - time.time())
+    if ttl <= 0:
+        return
+    try:
+        frappe.cache().set_value(f"bc_jwt:{digest}", (sub, payload), expires_in_sec=ttl)
+    except Exception:
+        pass
 
 
 def verify_clerk_bearer_and_get_sub():
@@ -60,6 +242,26 @@ def verify_clerk_bearer_and_get_sub():
     else:
         token = auth.strip()
 
+    # v rámci jedného requestu overujeme token iba raz
+    ctx = getattr(frappe.local, "bc_auth", None)
+    if ctx and ctx[0] == token:
+        return ctx[1], ctx[2]
+
+    digest = hashlib.sha256(f"{_clerk_issuer()}|{token}".encode()).hexdigest()
+
+    hit = _verified_tokens.get(digest)
+    if hit is None and _shared_verify_cache():
+        hit = _shared_verified_get(digest)
+        if hit is not None:
+            _verified_tokens.put(digest, *hit)
+
+    if hit is not None:
+        metrics.incr("jwt.cache_hits")
+        frappe.local.bc_auth = (token, *hit)
+        return hit
+
+    metrics.incr("jwt.cache_misses")
+
     try:
         signing_key = _jwks_client().get_signing_key_from_jwt(token)
         payload = jwt.decode(
@@ -69,26 +271,178 @@ def verify_clerk_bearer_and_get_sub():
             issuer=_clerk_issuer(),
             options={"verify_aud": False},
         )
-        return payload.get("sub"), payload
 
     except Exception as e:
         frappe.throw(f"Invalid Clerk token: {e}", frappe.PermissionError)
 
+    sub = payload.get("sub")
+    _verified_tokens.max_entries = cint(frappe.conf.get("clerk_verify_cache_size") or 2048)
+    _verified_tokens.put(digest, sub, payload)
+    if _shared_verify_cache():
+        _shared_verified_set(digest, sub, payload)
+
+    frappe.local.bc_auth = (token, sub, payload)
+    return sub, payload
+
+
+class CircuitBreaker:
+    """
+    Jednoduchý circuit breaker: po `threshold` zlyhaniach za sebou sa na
+    `reset_timeout` s otvorí (fail fast), potom pustí jeden skúšobný request.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._failures < self.threshold:
+                return True
+            # half-open: jeden pokus po uplynutí timeoutu
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+
+class ClerkHTTPClient:
+    """
+    Per-worker klient pre Clerk Management API:
+    - requests.Session s keep-alive poolom (bez TCP+TLS handshake pri každom volaní)
+    - oddelený connect / read timeout
+    - retry s jittered exponential backoff, rešpektuje Retry-After
+    - circuit breaker, keď je Clerk degradovaný
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    IDEMPOTENT = ("GET", "HEAD", "PUT", "PATCH", "DELETE")
+
+    def __init__(self):
+        self._pid = None
+        self._session = None
+        self._lock = threading.Lock()
+        self.breaker = CircuitBreaker()
+
+    def session(self) -> requests.Session:
+        # po forku (gunicorn preload) nesmieme zdieľať sockety s rodičom
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    sess = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+                    sess.mount("https://", adapter)
+                    sess.mount("http://", adapter)
+                    self._session = sess
+                    self._pid = os.getpid()
+        return self._session
+
+    @staticmethod
+    def _retry_after(resp) -> float | None:
+        value = resp.headers.get("Retry-After") if resp is not None else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except Exception:
+                return None
+
+    def request(self, method: str, url: str, headers: dict, json_body=None):
+        conf = frappe.conf
+        timeout = (
+            flt(conf.get("clerk_connect_timeout") or 3),
+            flt(conf.get("clerk_read_timeout") or 10),
+        )
+        max_retries = cint(conf.get("clerk_max_retries") if conf.get("clerk_max_retries") is not None else 3)
+        max_backoff = flt(conf.get("clerk_max_backoff") or 5)
+        self.breaker.threshold = cint(conf.get("clerk_breaker_threshold") or 5)
+        self.breaker.reset_timeout = flt(conf.get("clerk_breaker_reset") or 30)
+
+        method = method.upper()
+
+        if not self.breaker.allow():
+            metrics.incr("clerk.circuit_open")
+            frappe.throw("Clerk API temporarily unavailable (circuit open)")
+
+        attempt = 0
+        while True:
+            resp, error = None, None
+            started = time.monotonic()
+            try:
+                resp = self.session().request(method, url, headers=headers, json=json_body, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                error = e
+            finally:
+                metrics.observe("clerk.latency_ms", (time.monotonic() - started) * 1000)
+
+            if resp is not None:
+                metrics.incr(f"clerk.status.{resp.status_code}")
+            else:
+                metrics.incr("clerk.connection_errors")
+
+            retryable = False
+            if error is not None:
+                # POST iba ak request určite neodišiel (connect fáza)
+                retryable = method in self.IDEMPOTENT or isinstance(error, requests.exceptions.ConnectTimeout)
+            elif resp.status_code in self.RETRY_STATUSES:
+                retryable = resp.status_code == 429 or method in self.IDEMPOTENT
+
+            failed = error is not None or resp.status_code >= 500 or resp.status_code == 429
+
+            if not retryable or attempt >= max_retries:
+                if failed:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+
+                if error is not None:
+                    raise error
+                return resp
+
+            delay = random.uniform(0, min(max_backoff, 0.2 * (2 ** attempt)))
+            retry_after = self._retry_after(resp)
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, max_backoff))
+
+            metrics.incr("clerk.retries")
+            attempt += 1
+            time.sleep(delay)
+
+
+_clerk_http = ClerkHTTPClient()
+
 
 def clerk_api(path, method="GET", json_body=None):
     """
     volanie na Clerk Management API (server → server)
     """
 
-    url = f"https://api.clerk.com{path}"
+    base = (frappe.conf.get("clerk_api_url") or "https://api.clerk.com").rstrip("/")
+    url = f"{base}{path}"
     headers = {
         "Authorization": f"Bearer {_clerk_secret()}",
         "Content-Type": "application/json"
     }
 
     try:
-        resp = requests.request(method, url, headers=headers, json=json_body, timeout=30)
-    except Exception as e:
+        resp = _clerk_http.request(method, url, headers=headers, json_body=json_body)
+    except requests.exceptions.RequestException as e:
         frappe.throw(f"Clerk API connection error: {e}")
 
     if not (200 <= resp.status_code < 300):
@@ -102,48 +456,208 @@ def clerk_api(path, method="GET", json_body=None):
     return resp.json()
 
 # ---------------------------------------------------
-# User helpers
+# Clerk roles
 # ---------------------------------------------------
 
-def ensure_bc_user_by_clerk(clerk_id: str, email: str | None = None):
+def _role_from_claims(payload: dict | None):
     """
-    Upsert BC Pouzivatel podľa clerk_id.
-    Ak existuje → vráti doc.
-    Ak neexistuje → vytvorí.
+    Rola priamo z JWT, ak ju session-token template obsahuje.
+    Cesta k claimu je konfigurovateľná (`clerk_role_claim`, napr. "metadata.role").
     """
+    if not payload:
+        return None
 
-    name = frappe.db.get_value("BC Pouzivatel", {"clerk_id": clerk_id}, "name")
+    paths = [frappe.conf.get("clerk_role_claim") or "role", "public_metadata.role", "metadata.role"]
+    for path in paths:
+        value = payload
+        for part in path.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if isinstance(value, str) and value:
+            return value
 
-    if name:
-        doc = frappe.get_doc("BC Pouzivatel", name)
+    return None
 
-        if email and not doc.email:
-            frappe.db.set_value("BC Pouzivatel", name, "email", email)
 
-        return doc
+def _role_cache_key(clerk_id: str):
+    return f"bc_clerk_role:{clerk_id}"
 
-    # ak nemáme email, skúsime dotiahnuť z Clerka
-    if not email:
-        try:
+
+def get_clerk_role(clerk_id: str, payload: dict | None = None):
+    """
+    Rola používateľa (public_metadata.role) bez Clerk volania na hot path:
+    1. claim v JWT
+    2. lokálna cache rolí (Redis, krátke TTL)
+    3. stĺpec `role` v BC Pouzivatel (mirror z Clerk webhooku)
+    4. až potom Clerk Management API – výsledok sa nacachuje
+    """
+    role = _role_from_claims(payload)
+    if role:
+        return role
+
+    key = _role_cache_key(clerk_id)
+    role = frappe.cache().get_value(key)
+
+    if role is None:
+        metrics.incr("roles.cache_misses")
+
+        # lokálny mirror (plnený Clerk webhookom), Clerk API iba ak ho nemáme
+        role = frappe.db.get_value("BC Pouzivatel", {"clerk_id": clerk_id}, "role")
+        if not role:
             u = clerk_api(f"/v1/users/{clerk_id}")
-            primary_id = u.get("primary_email_address_id")
+            role = (u.get("public_metadata") or {}).get("role") or ""
 
-            if primary_id:
-                for e in u.get("email_addresses", []):
-                    if e.get("id") == primary_id:
-                        email = e.get("email_address")
-                        break
-        except Exception:
-            pass
+        frappe.cache().set_value(
+            key, role, expires_in_sec=cint(frappe.conf.get("clerk_role_cache_ttl") or 300)
+        )
+    else:
+        metrics.incr("roles.cache_hits")
 
-    doc = frappe.get_doc({
-        "doctype": "BC Pouzivatel",
+    return role or None
+
+
+def invalidate_clerk_role(clerk_id: str):
+    if clerk_id:
+        frappe.cache().delete_value(_role_cache_key(clerk_id))
+
+
+# ---------------------------------------------------
+# User helpers
+# ---------------------------------------------------
+
+def clerk_primary_email(u: dict):
+    """Primárny email z Clerk user objektu."""
+    primary_id = u.get("primary_email_address_id")
+
+    if primary_id:
+        for e in u.get("email_addresses") or []:
+            if e.get("id") == primary_id:
+                return e.get("email_address")
+
+    return None
+
+
+def _request_users() -> dict:
+    """Request-local memo clerk_id → ľahký záznam BC Pouzivatel."""
+    users = getattr(frappe.local, "bc_users", None)
+    if users is None:
+        users = frappe.local.bc_users = {}
+    return users
+
+
+BC_USER_CACHE = "bc_clerk_user"
+
+
+def _cached_bc_user(clerk_id: str):
+    """clerk_id → {name, clerk_id, email} cez Redis hash, fallback na DB (unique index)."""
+    user = frappe.cache().hget(BC_USER_CACHE, clerk_id)
+    if user:
+        metrics.incr("users.cache_hits")
+        return frappe._dict(user)
+
+    metrics.incr("users.cache_misses")
+    user = frappe.db.get_value(
+        "BC Pouzivatel", {"clerk_id": clerk_id}, ["name", "clerk_id", "email"], as_dict=True
+    )
+    if user:
+        frappe.cache().hset(BC_USER_CACHE, clerk_id, dict(user))
+    return user
+
+
+def invalidate_bc_user(clerk_id: str | None):
+    if clerk_id:
+        frappe.cache().hdel(BC_USER_CACHE, clerk_id)
+        _request_users().pop(clerk_id, None)
+
+
+def on_bc_pouzivatel_change(doc, method=None, *args, **kwargs):
+    """doc_events hook (on_update / after_rename / on_trash) → zahodí cache resolvera."""
+    invalidate_bc_user(doc.get("clerk_id"))
+
+    before = doc.get_doc_before_save() if method == "on_update" else None
+    if before and before.get("clerk_id") != doc.get("clerk_id"):
+        invalidate_bc_user(before.get("clerk_id"))
+
+
+def _insert_or_fetch_bc_user(clerk_id: str, email: str | None):
+    """
+    Race-free get-or-create: o duplicite rozhodne unique index na clerk_id,
+    súbežné prvé requesty skončia na tom istom zázname.
+    """
+    now = now_datetime()
+    values = {
+        "name": frappe.generate_hash(length=10),
         "clerk_id": clerk_id,
-        "email": email
-    })
-    doc.insert(ignore_permissions=True)
+        "email": email,
+        "creation": now,
+        "modified": now,
+        "owner": frappe.session.user,
+        "modified_by": frappe.session.user,
+    }
+
+    if frappe.db.db_type == "postgres":
+        frappe.db.sql(
+            """
+            insert into "tabBC Pouzivatel" (name, clerk_id, email, creation, modified, owner, modified_by)
+            values (%(name)s, %(clerk_id)s, %(email)s, %(creation)s, %(modified)s, %(owner)s, %(modified_by)s)
+            on conflict (clerk_id) do nothing
+            """,
+            values,
+        )
+    else:
+        frappe.db.sql(
+            """
+            insert into `tabBC Pouzivatel` (name, clerk_id, email, creation, modified, owner, modified_by)
+            values (%(name)s, %(clerk_id)s, %(email)s, %(creation)s, %(modified)s, %(owner)s, %(modified_by)s)
+            on duplicate key update clerk_id = clerk_id
+            """,
+            values,
+        )
+
+    # locking read: pri REPEATABLE READ by obyčajný SELECT nevidel riadok,
+    # ktorý práve commitol súbežný request (read view je zo skoršieho lookupu)
+    user = frappe.db.get_value(
+        "BC Pouzivatel", {"clerk_id": clerk_id}, ["name", "clerk_id", "email"], as_dict=True, for_update=True
+    )
+    if not user:
+        frappe.throw(f"BC Pouzivatel for {clerk_id} could not be created", frappe.ValidationError)
+    return user
+
+
+def ensure_bc_user_by_clerk(clerk_id: str, email: str | None = None, as_doc: bool = False):
+    """
+    Upsert BC Pouzivatel podľa clerk_id.
+    Ak existuje → vráti ho.
+    Ak neexistuje → vytvorí.
+
+    Default vracia ľahký záznam (name, clerk_id, email), memoizovaný
+    v rámci requestu a v Redis. Celý doc aj s child tabuľkou `zariadenie`
+    sa načíta iba pri `as_doc=True`.
+    """
+
+    users = _request_users()
+    user = users.get(clerk_id) or _cached_bc_user(clerk_id)
+
+    if not user:
+        # ak nemáme email, skúsime dotiahnuť z Clerka
+        # (pri zapnutom Clerk webhooku email doplní user.created event → bez HTTP volania)
+        if not email and not frappe.conf.get("clerk_webhook_secret"):
+            try:
+                email = clerk_primary_email(clerk_api(f"/v1/users/{clerk_id}"))
+            except Exception:
+                pass
+
+        user = _insert_or_fetch_bc_user(clerk_id, email)
+
+    if email and not user.email:
+        frappe.db.set_value("BC Pouzivatel", user.name, "email", email)
+        user.email = email
+        frappe.cache().hdel(BC_USER_CACHE, clerk_id)
+
+    users[clerk_id] = user
 
-    return doc
+    if as_doc:
+        return frappe.get_doc("BC Pouzivatel", user.name)
+    return user
 
 
 def ensure_settings():
@@ -161,81 +675,214 @@ def ensure_settings():
 
 
 # ---------------------------------------------------
-# APNs / VOIP PUSH
+# Raw SQL (MariaDB / Postgres)
 # ---------------------------------------------------
 
-import httpx
-from pathlib import Path
+def sql_table(doctype: str) -> str:
+    return f'"tab{doctype}"' if frappe.db.db_type == "postgres" else f"`tab{doctype}`"
 
-_apns_cached_token = {"token": None, "iat": 0}
 
-def _build_apns_jwt():
+def upsert_counters(doctype: str, fields: list[str], rows: list[tuple], counters: tuple):
     """
-    Apple APNs JWT je platný 1 hodinu → cache.
+    Multi-row INSERT; pri kolízii na `name` pripočíta `counters` k existujúcemu
+    riadku (ON DUPLICATE KEY UPDATE / ON CONFLICT). Riadky obsahujú hodnoty
+    `fields`, creation / modified / owner / modified_by sa doplnia.
     """
-    now = int(time.time())
-    if _apns_cached_token["token"] and now - _apns_cached_token["iat"] < 50 * 60:
-        return _apns_cached_token["token"]
+    if not rows:
+        return
+
+    now = now_datetime()
+    user = frappe.session.user
+    fields = [*fields, "creation", "modified", "owner", "modified_by"]
+    values = [(*r, now, now, user, user) for r in rows]
+
+    placeholders = ", ".join(["(" + ", ".join(["%s"] * len(fields)) + ")"] * len(values))
+    params = [v for row in values for v in row]
+    table = sql_table(doctype)
+
+    if frappe.db.db_type == "postgres":
+        updates = ", ".join(f"{c} = {table}.{c} + excluded.{c}" for c in counters)
+        conflict = f"on conflict (name) do update set {updates}, modified = excluded.modified"
+    else:
+        updates = ", ".join(f"{c} = {c} + values({c})" for c in counters)
+        conflict = f"on duplicate key update {updates}, modified = values(modified)"
+
+    frappe.db.sql(f"insert into {table} ({', '.join(fields)}) values {placeholders} {conflict}", params)
 
-    key_file = frappe.conf.get("apn_key_file")
-    key_id = frappe.conf.get("apn_key_id")
-    team_id = frappe.conf.get("apn_team_id")
 
-    if not (key_file and key_id and team_id):
-        frappe.throw("APNs config missing", frappe.ConfigurationError)
+# ---------------------------------------------------
+# Keyset pagination
+# ---------------------------------------------------
+
+def encode_cursor(*values) -> str:
+    """Nepriehľadný cursor z hodnôt posledného riadku stránky (napr. start_time, name)."""
+    raw = json.dumps([str(v) if v is not None else None for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
 
+
+def decode_cursor(cursor: str | None, size: int) -> list | None:
+    if not cursor:
+        return None
     try:
-        with open(key_file, "rb") as f:
-            p8 = f.read()
-    except Exception as e:
-        frappe.throw(f"APNs key file error: {e}")
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        frappe.throw("Invalid cursor", frappe.ValidationError)
+    return values
 
-    token = jwt.encode(
-        {"iss": team_id, "iat": now},
-        p8,
-        algorithm="ES256",
-        headers={"kid": key_id},
-    )
 
-    if isinstance(token, bytes):
-        token = token.decode("utf-8")
+def page_limit(limit, default: int = 50, maximum: int = 200) -> int:
+    return max(1, min(cint(limit) or default, maximum))
+
 
-    _apns_cached_token.update({"token": token, "iat": now})
-    return token
+# ---------------------------------------------------
+# APNs / VOIP PUSH
+# ---------------------------------------------------
 
+from . import apns
 
 def send_voip_push(device_token: str, payload: dict):
     """
-    Priamy HTTP/2 APNs VoIP push.
+    Priamy HTTP/2 APNs VoIP push cez zdieľaný klient workera.
     """
-    bundle_id = frappe.conf.get("apn_bundle_id")
-    prod = cint(frappe.conf.get("apn_production") or 0) == 1
+    result = apns.send_push(device_token, payload, push_type="voip")
 
-    host = "https://api.push.apple.com" if prod else "https://api.sandbox.push.apple.com"
-    url = f"{host}/3/device/{device_token}"
+    if not result["ok"]:
+        detail = result["reason"]
+        frappe.log_error(f"APNs error {result['status']}: {detail}", "BC APNs")
+        frappe.throw(f"APNs error {result['status']}: {detail}")
 
-    jwt_token = _build_apns_jwt()
-    headers = {
-        "authorization": f"bearer {jwt_token}",
-        "apns-topic": f"{bundle_id}.voip",
-        "apns-push-type": "voip",
-        "apns-expiration": str(int(time.time()) + 30),
-        "content-type": "application/json",
-    }
+    return {"apns_id": result.get("apns_id")}
 
-    with httpx.Client(http2=True, timeout=10) as client:
-        resp = client.post(url, headers=headers, content=json.dumps(payload))
 
-    if resp.status_code != 200:
-        try:
-            detail = resp.json()
-        except Exception:
-            detail = resp.text
+_push_pool = None
+_push_pool_lock = threading.Lock()
+
+
+def _push_executor() -> ThreadPoolExecutor:
+    global _push_pool
+    if _push_pool is None:
+        with _push_pool_lock:
+            if _push_pool is None:
+                _push_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="bc-voip")
+    return _push_pool
+
+
+def voip_tokens_for_clerk_user(clerk_id: str) -> list[dict]:
+    """
+    Registrované VoIP tokeny (BC Zariadenie) daného Clerk usera.
+    Zariadenia, ktoré nedávno opakovane zlyhali, sa preskočia
+    (ak by sa preskočili všetky, skúsime radšej všetky).
+    """
+    user = _request_users().get(clerk_id) or _cached_bc_user(clerk_id)
+    if not user:
+        return []
+
+    devices = frappe.get_all(
+        "BC Zariadenie",
+        filters={"parent": user.name, "parenttype": "BC Pouzivatel", "voip_token": ["is", "set"]},
+        fields=["name", "voip_token", "posledne_zlyhanie", "pocet_zlyhani"],
+    )
+
+    max_failures = cint(frappe.conf.get("voip_skip_after_failures") or 3)
+    cooldown = cint(frappe.conf.get("voip_failure_cooldown") or 600)
+    cutoff = add_to_date(now_datetime(), seconds=-cooldown)
+
+    healthy = [
+        d for d in devices
+        if (d.pocet_zlyhani or 0) < max_failures
+        or not d.posledne_zlyhanie
+        or get_datetime(d.posledne_zlyhanie) < cutoff
+    ]
+
+    if len(healthy) < len(devices):
+        metrics.incr("voip.skipped_devices", len(devices) - len(healthy))
+
+    return healthy or devices
+
+
+def apply_push_feedback(results: list[dict]):
+    """
+    Spätná väzba z APNs odpovedí – hromadne, max 3 dotazy:
+    - 410 / BadDeviceToken / ... → mŕtve tokeny zmažeme
+    - úspech → posledny_uspech, reset počítadla zlyhaní
+    - iné zlyhanie → posledne_zlyhanie, pocet_zlyhani + 1
+    Nedobehnuté ("pending") výsledky ignorujeme.
+    """
+    dead, ok, failed = [], [], []
+
+    for r in results:
+        if not r.get("device") or r.get("reason") == "pending":
+            continue
+        if r.get("ok"):
+            ok.append(r["device"])
+        elif r.get("status") == 410 or r.get("reason") in apns.DEAD_TOKEN_REASONS:
+            dead.append(r["device"])
+        else:
+            failed.append(r["device"])
+
+    now = now_datetime()
+    Z = frappe.qb.DocType("BC Zariadenie")
+
+    if dead:
+        frappe.db.delete("BC Zariadenie", {"name": ["in", dead]})
+        metrics.incr("voip.pruned_devices", len(dead))
+
+    if ok:
+        (
+            frappe.qb.update(Z)
+            .set(Z.posledny_uspech, now)
+            .set(Z.pocet_zlyhani, 0)
+            .where(Z.name.isin(ok))
+        ).run()
+
+    if failed:
+        (
+            frappe.qb.update(Z)
+            .set(Z.posledne_zlyhanie, now)
+            .set(Z.pocet_zlyhani, Z.pocet_zlyhani + 1)
+            .where(Z.name.isin(failed))
+        ).run()
+
+
+def fan_out_voip_push(
+    devices: list[dict],
+    payload: dict,
+    deadline: float = 5.0,
+    expiration: int | None = None,
+):
+    """
+    Pošle VoIP push na všetky zariadenia súbežne a počká na všetky
+    (volá sa z background jobu), najviac celkový `deadline` v sekundách.
+    `expiration` = apns-expiration (epoch).
+
+    Vracia zoznam výsledkov per zariadenie ("pending" = ešte nedobehlo).
+    """
+    if not devices:
+        return []
+
+    pool = _push_executor()
+    cfg = apns.config()
+    futures = {}
+    for dev in devices:
+        client, headers, body = apns.build_request(dev["voip_token"], payload, "voip", expiration, cfg=cfg)
+        futures[pool.submit(apns.deliver, client, dev["voip_token"], headers, body)] = dev
+
+    done, _ = wait(futures, timeout=max(0, deadline))
+    results = {f: f.result() for f in done}
+
+    apns.check_provider_token(results.values(), headers)
+
+    out = []
+    for f, dev in futures.items():
+        r = results.get(f) or {"ok": False, "status": None, "reason": "pending", "ms": None}
+        out.append({"device": dev.get("name"), "voip_token": dev["voip_token"], **r})
 
-        frappe.log_error(f"APNs error {resp.status_code}: {detail}", "BC APNs")
-        frappe.throw(f"APNs error {resp.status_code}: {detail}")
+    metrics.incr("voip.fanout")
+    metrics.incr("voip.fanout_devices", len(devices))
+    return out
 
-    return {"apns_id": resp.headers.get("apns-id")}
 
 # ---------------------------------------------------
 # Device helper – BC Zariadenie (child table)
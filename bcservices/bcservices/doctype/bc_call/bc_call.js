@@ -0,0 +1,8 @@
+// Copyright (c) 2026, Focus Hub s.r.o and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("BC Call", {
+// 	refresh(frm) {
+
+// 	},
+// });
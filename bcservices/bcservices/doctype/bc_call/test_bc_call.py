@@ -0,0 +1,109 @@
+# Copyright (c) 2026, Focus Hub s.r.o and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import IntegrationTestCase
+from frappe.utils import add_to_date, now_datetime
+
+from bcservices.api import call as call_api
+from bcservices.api.utils import ensure_bc_user_by_clerk
+
+
+# On IntegrationTestCase, the doctype test records and all
+# link-field test record dependencies are recursively loaded
+# Use these module variables to add/remove to/from that list
+EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+
+
+
+class IntegrationTestBCCall(IntegrationTestCase):
+	"""
+	Integration tests for BCCall.
+	Use this class for testing interactions between multiple components.
+	"""
+
+	def setUp(self):
+		suffix = frappe.generate_hash(length=8)
+		self.admin = f"user_test_admin_{suffix}"
+		self.client = f"user_test_client_{suffix}"
+
+		# email zadaný → bez volania Clerk API
+		self.payer = ensure_bc_user_by_clerk(self.client, f"{suffix}@example.com").name
+		self.token = frappe.get_doc({
+			"doctype": "BC Token",
+			"minuty_ostavajuce": 10,
+			"stav": "active",
+			"vydany_rok": now_datetime().year,
+			"aktualny_drzitel": self.payer,
+		}).insert(ignore_permissions=True)
+
+	def _api(self, method, clerk_id: str, **form):
+		frappe.local.form_dict = frappe._dict(form)
+		with patch.object(call_api, "verify_clerk_bearer_and_get_sub", return_value=(clerk_id, {})):
+			return method()
+
+	def test_answered_call_is_metered_on_end(self):
+		call_id = self._api(call_api.start, self.admin, callerId=self.admin, advisorId=self.client)["callId"]
+		self._api(call_api.accept, self.client, callId=call_id)
+
+		# 2:30 hovoru → 3 účtované minúty
+		frappe.db.set_value("BC Call", call_id, "answered_time", add_to_date(now_datetime(), seconds=-150))
+		res = self._api(call_api.end, self.admin, callId=call_id)
+
+		self.assertEqual(res["status"], "ended")
+		self.assertEqual(res["billedMinutes"], 3)
+		self.assertEqual(res["unbilledMinutes"], 0)
+		self.assertEqual(frappe.db.get_value("BC Token", self.token.name, "minuty_ostavajuce"), 7)
+
+		logs = frappe.get_all(
+			"BC Dennik hovorov",
+			filters={"pouzity_token": self.token.name},
+			fields=["volajuci", "poradca", "trvanie_s"],
+		)
+		self.assertEqual(len(logs), 1)
+		self.assertEqual(logs[0].poradca, self.payer)
+		self.assertGreaterEqual(logs[0].trvanie_s, 150)
+
+		# admin nemá BC Pouzivatel a zúčtovanie mu ho nezaloží
+		self.assertFalse(logs[0].volajuci)
+		self.assertFalse(frappe.db.exists("BC Pouzivatel", {"clerk_id": self.admin}))
+
+		# druhé end() hovor znova nezúčtuje
+		self._api(call_api.end, self.client, callId=call_id)
+		self.assertEqual(frappe.db.get_value("BC Token", self.token.name, "minuty_ostavajuce"), 7)
+
+	def test_partially_covered_call_logs_remainder_without_token(self):
+		frappe.db.set_value("BC Token", self.token.name, "minuty_ostavajuce", 2)
+
+		call_id = self._api(call_api.start, self.admin, callerId=self.admin, advisorId=self.client)["callId"]
+		self._api(call_api.accept, self.client, callId=call_id)
+		frappe.db.set_value("BC Call", call_id, "answered_time", add_to_date(now_datetime(), seconds=-200))
+		res = self._api(call_api.end, self.client, callId=call_id)
+
+		self.assertEqual(res["billedMinutes"], 2)
+		self.assertEqual(res["unbilledMinutes"], 2)
+		self.assertEqual(frappe.db.get_value("BC Token", self.token.name, "stav"), "spent")
+
+		logs = frappe.get_all(
+			"BC Dennik hovorov",
+			filters={"poradca": self.payer},
+			fields=["pouzity_token", "trvanie_s"],
+			order_by="zaciatok asc",
+		)
+		self.assertEqual([l.pouzity_token for l in logs], [self.token.name, None])
+		self.assertEqual(logs[0].trvanie_s, 120)
+		# log pokrýva celý hovor
+		self.assertEqual(sum(l.trvanie_s for l in logs), res["billedSeconds"])
+
+	def test_only_participants_can_end_call(self):
+		call_id = self._api(call_api.start, self.admin, callerId=self.admin, advisorId=self.client)["callId"]
+		self._api(call_api.accept, self.client, callId=call_id)
+
+		with self.assertRaises(frappe.PermissionError):
+			self._api(call_api.end, "user_test_stranger", callId=call_id)
+
+		self.assertEqual(frappe.db.get_value("BC Call", call_id, "status"), "ongoing")
+		self.assertEqual(frappe.db.get_value("BC Token", self.token.name, "minuty_ostavajuce"), 10)
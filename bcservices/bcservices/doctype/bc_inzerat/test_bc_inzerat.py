@@ -1,9 +1,17 @@
 # Copyright (c) 2025, Focus Hub s.r.o and Contributors
 # See license.txt
 
-# import frappe
+import random
+from decimal import Decimal
+from unittest.mock import patch
+
+import frappe
 from frappe.tests import IntegrationTestCase
 
+from bcservices.api import orderbook
+from bcservices.api.market import _open_listings
+from bcservices.api.utils import ensure_bc_user_by_clerk
+
 
 # On IntegrationTestCase, the doctype test records and all
 # link-field test record dependencies are recursively loaded
@@ -19,4 +27,97 @@ class IntegrationTestBCInzerat(IntegrationTestCase):
 	Use this class for testing interactions between multiple components.
 	"""
 
-	pass
+	def setUp(self):
+		# ročník, v ktorom nie sú žiadne iné listingy
+		self.year = random.randint(5000, 9000)
+		self.seller = self._user()
+		self.listings: list[str] = []
+
+	def tearDown(self):
+		# kniha žije v Redis, rollback testu ju nevyčistí
+		cache = frappe.cache()
+		cache.delete(orderbook._book(self.year))
+		cache.delete_value(f"{orderbook.BUILT_KEY}:{self.year}")
+		for listing in self.listings:
+			cache.hdel(orderbook.MEMBERS_KEY, listing)
+
+	def _user(self) -> str:
+		suffix = frappe.generate_hash(length=8)
+		return ensure_bc_user_by_clerk(f"user_test_{suffix}", f"{suffix}@example.com").name
+
+	def _list(self, seller: str, price, minutes: int = 60) -> str:
+		token = frappe.get_doc({
+			"doctype": "BC Token",
+			"minuty_ostavajuce": minutes,
+			"stav": "listed",
+			"vydany_rok": self.year,
+			"aktualny_drzitel": seller,
+		}).insert(ignore_permissions=True)
+		listing = frappe.get_doc({
+			"doctype": "BC Inzerat",
+			"token": token.name,
+			"predavajuci": seller,
+			"cena_eur": price,
+			"stav": "open",
+		}).insert(ignore_permissions=True).name
+		self.listings.append(listing)
+		return listing
+
+	def _pages(self, sort: str, limit: int = 2, **filters) -> list[list]:
+		params = {"year": self.year, "minPrice": None, "maxPrice": None, "minMinutes": None, **filters}
+		pages, cursor = [], None
+		while True:
+			page = _open_listings(limit=limit, cursor=cursor, sort=sort, **params)
+			pages.append(page["items"])
+			cursor = page["nextCursor"]
+			if not cursor:
+				return pages
+
+	def test_price_cursor_pages_through_all_listings_once(self):
+		prices = ["10.10", "10.10", "10.10", "9.99", "10.20", "10.30"]
+		for price in prices:
+			self._list(self.seller, price)
+
+		pages = self._pages("price")
+		items = [i for page in pages for i in page]
+
+		self.assertEqual(len(pages), 3)
+		self.assertEqual(len({i.name for i in items}), len(prices))
+		# (cena, name) rastúco, rovnaké ceny podľa name – cursor na hranici
+		# stránky medzi dvoma 10.10 nič nepreskočí ani nezopakuje
+		self.assertEqual(
+			[(Decimal(str(i.cena_eur)), i.name) for i in items],
+			sorted((Decimal(str(i.cena_eur)), i.name) for i in items),
+		)
+		self.assertEqual(Decimal(str(items[0].cena_eur)), Decimal("9.99"))
+
+	def test_recent_cursor_and_filters(self):
+		cheap = self._list(self.seller, "5.00", minutes=10)
+		mid = self._list(self.seller, "7.50", minutes=60)
+		pricey = self._list(self.seller, "12.00", minutes=60)
+
+		items = [i.name for page in self._pages("recent") for i in page]
+		self.assertEqual(items, [pricey, mid, cheap])
+
+		filtered = [i.name for page in self._pages("price", maxPrice=8, minMinutes=30) for i in page]
+		self.assertEqual(filtered, [mid])
+
+	def test_claim_asks_pages_past_buyers_own_asks(self):
+		buyer = self._user()
+		# prvú stránku knihy zaplnia vlastné asks kupujúceho
+		self._list(buyer, "5.00")
+		self._list(buyer, "6.00")
+		first = self._list(self.seller, "7.00")
+		self._list(self.seller, "8.00")
+		orderbook.rebuild_order_book(self.year)
+
+		with patch.object(orderbook, "CLAIM_PAGE", 2):
+			self.assertEqual(orderbook.claim_asks(self.year, 1, buyer), [first])
+
+			# cenový limit zastaví stránkovanie pred cudzími asks
+			with self.assertRaises(frappe.ValidationError):
+				orderbook.claim_asks(self.year, 1, buyer, max_price=6.5)
+
+			# viac, než kniha cudzích asks ponúka
+			with self.assertRaises(frappe.ValidationError):
+				orderbook.claim_asks(self.year, 3, buyer)
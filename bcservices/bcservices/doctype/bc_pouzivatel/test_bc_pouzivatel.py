@@ -1,8 +1,26 @@
 # Copyright (c) 2025, Focus Hub s.r.o and Contributors
 # See license.txt
 
-# import frappe
-from frappe.tests import IntegrationTestCase
+import json
+import threading
+import time
+from unittest.mock import MagicMock, patch
+
+import frappe
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from frappe.tests import IntegrationTestCase, UnitTestCase
+
+from bcservices.api.utils import (
+	CircuitBreaker,
+	ClerkHTTPClient,
+	JWKSKeyStore,
+	VerifiedTokenCache,
+	_cached_bc_user,
+	_insert_or_fetch_bc_user,
+	ensure_bc_user_by_clerk,
+)
+from bcservices.patches.v0_1.dedupe_bc_pouzivatel_clerk_id import _merge_into
 
 
 # On IntegrationTestCase, the doctype test records and all
@@ -13,10 +31,250 @@ IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
 
 
 
+def _in_other_connection(fn):
+	"""Spustí `fn` v samostatnom DB spojení (vlastná transakcia, commit)."""
+	site, sites_path = frappe.local.site, frappe.local.sites_path
+	result = {}
+
+	def run():
+		frappe.init(site, sites_path=sites_path)
+		frappe.connect()
+		try:
+			result["value"] = fn()
+			frappe.db.commit()
+		except Exception as e:
+			result["error"] = e
+			frappe.db.rollback()
+		finally:
+			frappe.destroy()
+
+	thread = threading.Thread(target=run)
+	thread.start()
+	thread.join(30)
+	if "error" in result:
+		raise result["error"]
+	return result.get("value")
+
+
 class IntegrationTestBCPouzivatel(IntegrationTestCase):
 	"""
 	Integration tests for BCPouzivatel.
 	Use this class for testing interactions between multiple components.
 	"""
 
-	pass
+	def _clerk_id(self) -> str:
+		return f"user_test_{frappe.generate_hash(length=10)}"
+
+	def test_insert_or_fetch_returns_existing_row(self):
+		clerk_id = self._clerk_id()
+		first = _insert_or_fetch_bc_user(clerk_id, "first@example.com")
+		second = _insert_or_fetch_bc_user(clerk_id, "second@example.com")
+
+		self.assertEqual(first.name, second.name)
+		self.assertEqual(second.email, "first@example.com")
+		self.assertEqual(frappe.db.count("BC Pouzivatel", {"clerk_id": clerk_id}), 1)
+
+	def test_insert_race_returns_row_committed_by_other_request(self):
+		clerk_id = self._clerk_id()
+
+		# read view tejto transakcie vzniká pri lookupe (ešte bez riadku)
+		self.assertIsNone(_cached_bc_user(clerk_id))
+
+		# súbežný prvý request vyhrá insert a commitne
+		winner = _in_other_connection(lambda: _insert_or_fetch_bc_user(clerk_id, None).name)
+		self.addCleanup(self._delete_committed, winner)
+
+		user = _insert_or_fetch_bc_user(clerk_id, None)
+		self.assertEqual(user.name, winner)
+
+	def _delete_committed(self, name: str):
+		# najprv uvoľniť zámok (FOR UPDATE) tejto transakcie
+		frappe.db.rollback()
+		_in_other_connection(lambda: frappe.delete_doc("BC Pouzivatel", name, force=True, ignore_permissions=True))
+
+	def test_missing_row_after_insert_throws(self):
+		with patch.object(frappe.db, "get_value", return_value=None):
+			with self.assertRaises(frappe.ValidationError):
+				_insert_or_fetch_bc_user(self._clerk_id(), None)
+
+	def test_dedupe_merge_keeps_devices_and_links(self):
+		keep = ensure_bc_user_by_clerk(self._clerk_id(), "keep@example.com", as_doc=True)
+		dup = ensure_bc_user_by_clerk(self._clerk_id(), "dup@example.com", as_doc=True)
+
+		keep.append("zariadenie", {"voip_token": "keep-voip"})
+		keep.save(ignore_permissions=True)
+		dup.append("zariadenie", {"voip_token": "dup-voip-1"})
+		dup.append("zariadenie", {"voip_token": "dup-voip-2"})
+		dup.save(ignore_permissions=True)
+
+		token = frappe.get_doc({
+			"doctype": "BC Token",
+			"minuty_ostavajuce": 60,
+			"stav": "active",
+			"aktualny_drzitel": dup.name,
+		}).insert(ignore_permissions=True)
+
+		_merge_into(dup.name, keep.name)
+
+		self.assertFalse(frappe.db.exists("BC Pouzivatel", dup.name))
+		devices = frappe.get_doc("BC Pouzivatel", keep.name).zariadenie
+		self.assertEqual([d.voip_token for d in devices], ["keep-voip", "dup-voip-1", "dup-voip-2"])
+		self.assertEqual([d.idx for d in devices], [1, 2, 3])
+		self.assertEqual(frappe.db.get_value("BC Token", token.name, "aktualny_drzitel"), keep.name)
+
+
+def _jwks(*kids: str) -> dict:
+	keys = []
+	for kid in kids:
+		public = rsa.generate_private_key(public_exponent=65537, key_size=2048).public_key()
+		keys.append({**json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(public)), "kid": kid, "use": "sig", "alg": "RS256"})
+	return {"keys": keys}
+
+
+def _jwks_response(doc: dict) -> MagicMock:
+	resp = MagicMock()
+	resp.json.return_value = doc
+	return resp
+
+
+class UnitTestJWKSKeyStore(UnitTestCase):
+	def setUp(self):
+		self.store = JWKSKeyStore("https://clerk.test/.well-known/jwks.json", min_refetch_interval=30)
+
+	def test_kid_lookup_fetches_once(self):
+		with patch("bcservices.api.utils.requests.get", return_value=_jwks_response(_jwks("k1", "k2"))) as get:
+			self.assertEqual(self.store.get_signing_key("k1").key_id, "k1")
+			self.assertEqual(self.store.get_signing_key("k2").key_id, "k2")
+			self.assertEqual(self.store.get_signing_key("k1").key_id, "k1")
+
+		self.assertEqual(get.call_count, 1)
+		self.assertEqual(self.store.stats["hits"], 2)
+
+	def test_unknown_kid_refetch_is_rate_limited(self):
+		with patch("bcservices.api.utils.requests.get", return_value=_jwks_response(_jwks("k1"))) as get:
+			self.store.get_signing_key("k1")
+
+			for _ in range(5):
+				with self.assertRaises(jwt.PyJWKClientError):
+					self.store.get_signing_key("unknown")
+
+			self.assertEqual(get.call_count, 1)
+			self.assertEqual(self.store.stats["rate_limited"], 5)
+
+			# po min_refetch_interval sa neznámy kid smie znova dotiahnuť (rotácia kľúča)
+			get.return_value = _jwks_response(_jwks("k1", "rotated"))
+			self.store._last_attempt -= 31
+			self.assertEqual(self.store.get_signing_key("rotated").key_id, "rotated")
+			self.assertEqual(get.call_count, 2)
+
+	def test_stale_keys_survive_failed_refetch(self):
+		with patch("bcservices.api.utils.requests.get", return_value=_jwks_response(_jwks("k1"))):
+			self.store.get_signing_key("k1")
+
+		# kľúče expirovali a Clerk je nedostupný → známy kid stále prejde
+		self.store._fetched_at -= self.store.ttl + 1
+		self.store._last_attempt -= self.store.ttl + 1
+		with patch("bcservices.api.utils.requests.get", side_effect=ConnectionError):
+			self.assertEqual(self.store.get_signing_key("k1").key_id, "k1")
+		self.assertEqual(self.store.stats["fetch_errors"], 1)
+
+
+class UnitTestVerifiedTokenCache(UnitTestCase):
+	def test_entry_expires_at_token_exp(self):
+		cache = VerifiedTokenCache()
+		cache.put("live", "user_1", {"sub": "user_1", "exp": time.time() + 60})
+		cache.put("dead", "user_2", {"sub": "user_2", "exp": time.time() - 1})
+
+		self.assertEqual(cache.get("live")[0], "user_1")
+		self.assertIsNone(cache.get("dead"))
+		self.assertNotIn("dead", cache._items)
+
+		# položka sa zahodí presne pri exp, nie až pri vyprataní LRU
+		with patch("bcservices.api.utils.time.time", return_value=time.time() + 61):
+			self.assertIsNone(cache.get("live"))
+		self.assertNotIn("live", cache._items)
+
+	def test_token_without_exp_is_not_cached(self):
+		cache = VerifiedTokenCache()
+		cache.put("no-exp", "user_1", {"sub": "user_1"})
+		self.assertIsNone(cache.get("no-exp"))
+
+	def test_least_recently_used_entry_is_evicted(self):
+		cache = VerifiedTokenCache(max_entries=2)
+		exp = time.time() + 60
+		cache.put("a", "user_a", {"exp": exp})
+		cache.put("b", "user_b", {"exp": exp})
+		cache.get("a")
+		cache.put("c", "user_c", {"exp": exp})
+
+		self.assertIsNotNone(cache.get("a"))
+		self.assertIsNone(cache.get("b"))
+		self.assertIsNotNone(cache.get("c"))
+
+
+def _http_response(status: int, headers: dict | None = None) -> MagicMock:
+	resp = MagicMock(status_code=status, headers=headers or {})
+	return resp
+
+
+class UnitTestClerkCircuitBreaker(UnitTestCase):
+	def test_opens_after_threshold_and_half_opens_after_timeout(self):
+		breaker = CircuitBreaker(threshold=3, reset_timeout=30)
+		for _ in range(3):
+			self.assertTrue(breaker.allow())
+			breaker.failure()
+
+		self.assertFalse(breaker.allow())
+
+		# half-open: po timeoute práve jeden skúšobný request
+		breaker._opened_at -= 31
+		self.assertTrue(breaker.allow())
+		self.assertFalse(breaker.allow())
+
+		# skúšobný request zlyhal → znova otvorený na celý timeout
+		breaker.failure()
+		self.assertFalse(breaker.allow())
+
+		breaker._opened_at -= 31
+		self.assertTrue(breaker.allow())
+		breaker.success()
+		self.assertTrue(breaker.allow())
+		self.assertTrue(breaker.allow())
+
+	def test_open_circuit_fails_fast_without_http(self):
+		client = ClerkHTTPClient()
+		session = MagicMock()
+		session.request.return_value = _http_response(503)
+
+		with patch.object(client, "session", return_value=session), patch("bcservices.api.utils.time.sleep"):
+			for _ in range(5):
+				client.request("GET", "https://clerk.test/v1/users", headers={})
+			calls = session.request.call_count
+
+			with self.assertRaises(frappe.ValidationError):
+				client.request("GET", "https://clerk.test/v1/users", headers={})
+
+		self.assertEqual(session.request.call_count, calls)
+
+	def test_retries_idempotent_request_and_honours_retry_after(self):
+		client = ClerkHTTPClient()
+		session = MagicMock()
+		session.request.side_effect = [_http_response(429, {"Retry-After": "2"}), _http_response(200)]
+
+		with patch.object(client, "session", return_value=session), patch("bcservices.api.utils.time.sleep") as sleep:
+			resp = client.request("GET", "https://clerk.test/v1/users", headers={})
+
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(session.request.call_count, 2)
+		self.assertGreaterEqual(sleep.call_args[0][0], 2)
+
+	def test_post_is_not_retried_after_server_error(self):
+		client = ClerkHTTPClient()
+		session = MagicMock()
+		session.request.return_value = _http_response(503)
+
+		with patch.object(client, "session", return_value=session), patch("bcservices.api.utils.time.sleep"):
+			resp = client.request("POST", "https://clerk.test/v1/users", headers={})
+
+		self.assertEqual(resp.status_code, 503)
+		self.assertEqual(session.request.call_count, 1)
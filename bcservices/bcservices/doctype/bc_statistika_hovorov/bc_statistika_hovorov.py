@@ -0,0 +1,9 @@
+# Copyright (c) 2026, Focus Hub s.r.o and contributors
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+
+
+class BCStatistikaHovorov(Document):
+	pass
@@ -1,9 +1,14 @@
 # Copyright (c) 2025, Focus Hub s.r.o and Contributors
 # See license.txt
 
-# import frappe
+import random
+
+import frappe
 from frappe.tests import IntegrationTestCase
 
+from bcservices.api.treasury import claim_treasury_tokens
+from bcservices.bcservices.doctype.bc_pouzivatel.test_bc_pouzivatel import _in_other_connection
+
 
 # On IntegrationTestCase, the doctype test records and all
 # link-field test record dependencies are recursively loaded
@@ -13,10 +18,52 @@ IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
 
 
 
+def _mint(year: int, count: int) -> list[str]:
+	names = []
+	for _ in range(count):
+		names.append(frappe.get_doc({
+			"doctype": "BC Token",
+			"minuty_ostavajuce": 60,
+			"stav": "active",
+			"vydany_rok": year,
+		}).insert(ignore_permissions=True).name)
+	return names
+
+
 class IntegrationTestBCToken(IntegrationTestCase):
 	"""
 	Integration tests for BCToken.
 	Use this class for testing interactions between multiple components.
 	"""
 
-	pass
+	def setUp(self):
+		# ročník, v ktorom nie sú žiadne iné tokeny
+		self.year = random.randint(5000, 9000)
+
+	def test_claim_returns_oldest_free_tokens(self):
+		minted = _mint(self.year, 4)
+		self.assertEqual(claim_treasury_tokens(2, self.year), minted[:2])
+
+	def test_claim_more_than_available_throws(self):
+		_mint(self.year, 2)
+		with self.assertRaises(frappe.ValidationError):
+			claim_treasury_tokens(3, self.year)
+
+	def test_concurrent_claims_skip_locked_tokens(self):
+		# tokeny musia byť commitnuté, aby ich videlo aj druhé spojenie
+		minted = _in_other_connection(lambda: _mint(self.year, 4))
+		self.addCleanup(self._delete_committed, minted)
+
+		mine = claim_treasury_tokens(2, self.year)
+
+		# druhý kupujúci nečaká na zamknuté riadky, dostane ďalšie
+		theirs = _in_other_connection(lambda: claim_treasury_tokens(2, self.year))
+		self.assertEqual(mine, minted[:2])
+		self.assertEqual(theirs, minted[2:])
+
+		with self.assertRaises(frappe.ValidationError):
+			_in_other_connection(lambda: claim_treasury_tokens(3, self.year))
+
+	def _delete_committed(self, names: list[str]):
+		frappe.db.rollback()
+		_in_other_connection(lambda: frappe.db.delete("BC Token", {"name": ["in", names]}))
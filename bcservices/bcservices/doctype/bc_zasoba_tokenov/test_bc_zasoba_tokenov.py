@@ -0,0 +1,64 @@
+# Copyright (c) 2026, Focus Hub s.r.o and Contributors
+# See license.txt
+
+import json
+from unittest.mock import MagicMock, patch
+
+import frappe
+from frappe.tests import IntegrationTestCase
+
+from bcservices.api import public
+from bcservices.api.http_cache import _bump_now, cached_json
+
+
+# On IntegrationTestCase, the doctype test records and all
+# link-field test record dependencies are recursively loaded
+# Use these module variables to add/remove to/from that list
+EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+
+
+
+class IntegrationTestBCZasobaTokenov(IntegrationTestCase):
+	"""
+	Integration tests for BCZasobaTokenov.
+	Use this class for testing interactions between multiple components.
+	"""
+
+	def _get(self, fn, if_none_match: str | None = None):
+		headers = {"If-None-Match": if_none_match} if if_none_match else {}
+		with patch.object(frappe, "get_request_header", side_effect=lambda key, default=None: headers.get(key, default)):
+			return fn()
+
+	def test_supply_is_served_with_etag_and_304(self):
+		first = self._get(lambda: public.supply(year=2026))
+
+		self.assertEqual(first.status_code, 200)
+		self.assertTrue(first.headers["ETag"].startswith('W/"supply-'))
+		self.assertIn("max-age=", first.headers["Cache-Control"])
+		self.assertEqual(json.loads(first.get_data())["message"]["year"], 2026)
+
+		again = self._get(lambda: public.supply(year=2026), first.headers["ETag"])
+		self.assertEqual(again.status_code, 304)
+		self.assertEqual(again.get_data(), b"")
+
+		# iný ročník = iný ETag
+		other = self._get(lambda: public.supply(year=2025), first.headers["ETag"])
+		self.assertEqual(other.status_code, 200)
+		self.assertNotEqual(other.headers["ETag"], first.headers["ETag"])
+
+	def test_version_bump_invalidates_etag_and_body(self):
+		name = f"test_{frappe.generate_hash(length=8)}"
+		build = MagicMock(side_effect=[{"n": 1}, {"n": 2}])
+
+		first = self._get(lambda: cached_json(name, {}, build))
+		cached = self._get(lambda: cached_json(name, {}, build))
+		self.assertEqual(build.call_count, 1)
+		self.assertEqual(cached.get_data(), first.get_data())
+
+		_bump_now()
+
+		fresh = self._get(lambda: cached_json(name, {}, build), first.headers["ETag"])
+		self.assertEqual(fresh.status_code, 200)
+		self.assertNotEqual(fresh.headers["ETag"], first.headers["ETag"])
+		self.assertEqual(json.loads(fresh.get_data())["message"], {"n": 2})
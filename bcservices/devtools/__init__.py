@@ -0,0 +1,23 @@
+# apps/bcservices/bcservices/devtools/__init__.py
+#
+# Lokálne náhrady za Apple APNs, Clerk a Stripe + benchmark harness.
+# Nič z tohto sa nenačíta v produkcii – spúšťa sa ručne z bench virtualenvu:
+#
+#   ./env/bin/python -m bcservices.devtools.mock_apns   --port 2197 --latency-ms 20
+#   ./env/bin/python -m bcservices.devtools.mock_clerk  --port 8787
+#   ./env/bin/python -m bcservices.devtools.mock_stripe --port 12111 \
+#       --webhook-url http://site.localhost:8000/api/method/bcservices.api.payment.stripe_webhook \
+#       --webhook-secret whsec_local
+#   ./env/bin/python -m bcservices.devtools.bench --site-url http://site.localhost:8000 --scenario call-start
+#
+# site_config.json pre lokálny beh:
+#
+#   "apns_host": "http://127.0.0.1:2197",
+#   "clerk_issuer": "http://127.0.0.1:8787",
+#   "clerk_api_url": "http://127.0.0.1:8787",
+#   "stripe_api_base": "http://127.0.0.1:12111",
+#   "stripe_secret_key": "sk_test_local",
+#   "stripe_webhook_secret": "whsec_local",
+#   "clerk_secret_key": "sk_test_local",
+#   "apns_key_file": "/tmp/apns_mock.p8",  (mock_apns --write-key /tmp/apns_mock.p8)
+#   "apns_key_id": "MOCKKEY", "apns_team_id": "MOCKTEAM", "apns_bundle_id": "sk.babylo.client"
@@ -0,0 +1,249 @@
+# apps/bcservices/bcservices/devtools/bench.py
+"""
+Benchmark harness – volá skutočné endpointy bežiacej site-y, ktorá je
+nakonfigurovaná proti lokálnym mockom (viď devtools/__init__.py).
+
+Scenáre:
+  call-start  – POST call.start (admin → klient), meria HTTP latenciu,
+                call-setup latenciu (request → push prijatý mock APNs) a pushe/s
+  sync-user   – POST auth.sync_user pre --users rôznych Clerk userov
+  checkout    – POST payment.checkout_treasury, meria throughput checkoutu
+                a (z mock Stripe) latenciu webhookov
+
+    python -m bcservices.devtools.bench --site-url http://site.localhost:8000 \
+        --scenario call-start --requests 2000 --concurrency 32 --devices 3
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+API = "/api/method/bcservices.api"
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.site = args.site_url.rstrip("/")
+        self._local = threading.local()
+
+    def http(self) -> requests.Session:
+        # jedna keep-alive session na thread
+        s = getattr(self._local, "session", None)
+        if s is None:
+            s = self._local.session = requests.Session()
+        return s
+
+    def token(self, sub: str | None = None, role: str | None = None) -> tuple[str, str]:
+        params = {"ttl": 3600}
+        if sub:
+            params["sub"] = sub
+        if role:
+            params["role"] = role
+        r = self.http().get(f"{self.args.clerk_url}/_test/token", params=params, timeout=10)
+        r.raise_for_status()
+        data = r.json()
+        return data["sub"], data["jwt"]
+
+    def call(self, method: str, jwt_token: str, data: dict | None = None, http_method: str = "POST"):
+        r = self.http().request(
+            http_method,
+            f"{self.site}{API}.{method}",
+            headers={"X-Clerk-Authorization": f"Bearer {jwt_token}"},
+            data=data,
+            timeout=30,
+        )
+        if r.status_code != 200:
+            raise RuntimeError(f"{method} → HTTP {r.status_code}: {r.text[:200]}")
+        return r.json().get("message")
+
+    def apns_stats(self) -> dict:
+        return requests.get(f"{self.args.apns_stats_url}", timeout=10).json()
+
+    def stripe_stats(self) -> dict:
+        return requests.get(f"{self.args.stripe_url}/_test/stats", timeout=10).json()
+
+    # ------------------------------------------------------------------
+    # Runner
+    # ------------------------------------------------------------------
+
+    def run(self, fn, n: int) -> dict:
+        latencies: list[float] = []
+        errors: dict[str, int] = {}
+        lock = threading.Lock()
+
+        def one(i):
+            started = time.perf_counter()
+            try:
+                fn(i)
+            except Exception as e:
+                key = str(e)[:80]
+                with lock:
+                    errors[key] = errors.get(key, 0) + 1
+                return
+            with lock:
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as ex:
+            list(ex.map(one, range(n)))
+        elapsed = time.perf_counter() - started
+
+        return {
+            "requests": n,
+            "ok": len(latencies),
+            "errors": errors,
+            "seconds": round(elapsed, 3),
+            "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+            **percentiles("latency", latencies),
+        }
+
+    # ------------------------------------------------------------------
+    # Scenarios
+    # ------------------------------------------------------------------
+
+    def scenario_call_start(self) -> dict:
+        a = self.args
+        admin_id, admin_jwt = self.token(role="admin")
+
+        advisors = []
+        for _ in range(a.users):
+            sub, jwt_token = self.token(role="client")
+            for _ in range(a.devices):
+                self.call("device.register_device", jwt_token, {"voip_token": uuid.uuid4().hex * 2})
+            advisors.append(sub)
+
+        sent: dict[str, float] = {}
+        lock = threading.Lock()
+        before = self.apns_stats()
+
+        def start(i):
+            t0 = time.time()
+            res = self.call(
+                "call.start",
+                admin_jwt,
+                {"callerId": admin_id, "advisorId": advisors[i % len(advisors)]},
+            )
+            with lock:
+                sent[res["callId"]] = t0
+
+        out = self.run(start, a.requests)
+
+        # dopočkáme na background pushe
+        expected = before["total"] + len(sent) * a.devices
+        deadline = time.time() + a.drain_timeout
+        after = self.apns_stats()
+        while after["total"] < expected and time.time() < deadline:
+            time.sleep(0.5)
+            after = self.apns_stats()
+
+        received = after.get("calls") or {}
+        setup = [(received[c] - t0) * 1000 for c, t0 in sent.items() if c in received]
+        pushes = after["total"] - before["total"]
+        span = [received[c] for c in sent if c in received]
+
+        out.update(percentiles("call_setup", setup))
+        out["pushes"] = pushes
+        out["pushes_per_second"] = (
+            round(pushes / (max(span) - min(sent.values())), 1) if span and max(span) > min(sent.values()) else None
+        )
+        out["calls_without_push"] = len(sent) - len(setup)
+        return out
+
+    def scenario_sync_user(self) -> dict:
+        users = [self.token()[1] for _ in range(self.args.users)]
+        return self.run(lambda i: self.call("auth.sync_user", users[i % len(users)]), self.args.requests)
+
+    def scenario_checkout(self) -> dict:
+        a = self.args
+        _, admin_jwt = self.token(role="admin")
+        year = a.year or time.localtime().tm_year
+
+        # treasury musí mať dosť tokenov (mint je pomalý – po dávkach)
+        remaining = a.requests
+        while remaining > 0:
+            batch = min(remaining, 500)
+            self.call("admin.mint", admin_jwt, {"quantity": batch, "priceEur": 10, "year": year})
+            remaining -= batch
+
+        users = [self.token(role="client")[1] for _ in range(a.users)]
+        before = self.stripe_stats()
+
+        out = self.run(
+            lambda i: self.call(
+                "payment.checkout_treasury", users[i % len(users)], {"quantity": 1, "year": year}
+            ),
+            a.requests,
+        )
+
+        deadline = time.time() + a.drain_timeout
+        after = self.stripe_stats()
+        while (
+            after["webhooks_ok"] + after["webhooks_failed"] - before["webhooks_ok"] - before["webhooks_failed"]
+            < out["ok"]
+            and time.time() < deadline
+        ):
+            time.sleep(0.5)
+            after = self.stripe_stats()
+
+        out["webhooks_ok"] = after["webhooks_ok"] - before["webhooks_ok"]
+        out["webhooks_failed"] = after["webhooks_failed"] - before["webhooks_failed"]
+        out["webhook_p50_ms"] = after.get("webhook_p50_ms")
+        out["webhook_p95_ms"] = after.get("webhook_p95_ms")
+        return out
+
+
+def percentiles(prefix: str, values: list[float]) -> dict:
+    if not values:
+        return {f"{prefix}_p50_ms": None, f"{prefix}_p95_ms": None, f"{prefix}_p99_ms": None}
+    values = sorted(values)
+
+    def q(p):
+        return round(values[min(len(values) - 1, int(len(values) * p))], 2)
+
+    return {f"{prefix}_p50_ms": q(0.50), f"{prefix}_p95_ms": q(0.95), f"{prefix}_p99_ms": q(0.99)}
+
+
+SCENARIOS = {
+    "call-start": Bench.scenario_call_start,
+    "sync-user": Bench.scenario_sync_user,
+    "checkout": Bench.scenario_checkout,
+}
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="BC endpoint benchmark against local mocks")
+    p.add_argument("--site-url", required=True)
+    p.add_argument("--scenario", choices=sorted(SCENARIOS), required=True)
+    p.add_argument("--requests", type=int, default=500)
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--users", type=int, default=50, help="počet rôznych Clerk userov")
+    p.add_argument("--devices", type=int, default=1, help="zariadenia na klienta (call-start)")
+    p.add_argument("--year", type=int)
+    p.add_argument("--drain-timeout", type=float, default=60, help="čakanie na background pushe / webhooky")
+    p.add_argument("--clerk-url", default="http://127.0.0.1:8787")
+    p.add_argument("--apns-stats-url", default="http://127.0.0.1:2198")
+    p.add_argument("--stripe-url", default="http://127.0.0.1:12111")
+    p.add_argument("--json", action="store_true", help="výstup ako JSON")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = SCENARIOS[args.scenario](Bench(args))
+    result["scenario"] = args.scenario
+
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for key, value in result.items():
+        print(f"{key:>24}: {value}")
+
+
+if __name__ == "__main__":
+    main()
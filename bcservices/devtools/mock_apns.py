@@ -0,0 +1,232 @@
+# apps/bcservices/bcservices/devtools/mock_apns.py
+"""
+Lokálny HTTP/2 (h2c, prior knowledge) stand-in za api.push.apple.com.
+
+- POST /3/device/<token> → 200 + apns-id (alebo injektovaná chyba)
+- tokeny začínajúce na "dead" vrátia vždy 410 Unregistered
+- konfigurovateľná latencia, chybovosť a GOAWAY po N streamoch
+- štatistiky (pushe/s, statusy, čas prijatia podľa callId) na --stats-port
+
+    python -m bcservices.devtools.mock_apns --port 2197 --latency-ms 20 --unregistered-rate 0.05
+    python -m bcservices.devtools.mock_apns --write-key /tmp/apns_mock.p8
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from h2.config import H2Configuration
+from h2.connection import H2Connection
+from h2.events import ConnectionTerminated, DataReceived, RequestReceived, StreamEnded, StreamReset
+
+
+class Stats:
+    def __init__(self):
+        self.started = time.time()
+        self.total = 0
+        self.by_status: dict[int, int] = {}
+        self.connections = 0
+        self.goaways = 0
+        # callId → čas prijatia (pre meranie call-setup latencie)
+        self.calls: dict[str, float] = {}
+
+    def record(self, status: int, body: bytes):
+        self.total += 1
+        self.by_status[status] = self.by_status.get(status, 0) + 1
+        try:
+            call_id = json.loads(body or b"{}").get("callId")
+        except Exception:
+            call_id = None
+        if call_id:
+            self.calls[call_id] = time.time()
+
+    def as_dict(self):
+        elapsed = max(time.time() - self.started, 1e-9)
+        return {
+            "total": self.total,
+            "pushesPerSecond": round(self.total / elapsed, 2),
+            "byStatus": self.by_status,
+            "connections": self.connections,
+            "goaways": self.goaways,
+            "calls": self.calls,
+        }
+
+
+class MockAPNs:
+    def __init__(self, args):
+        self.args = args
+        self.stats = Stats()
+
+    def outcome(self, headers: dict, device_token: str):
+        a = self.args
+
+        if not headers.get("authorization", "").startswith("bearer "):
+            return 403, "MissingProviderToken"
+        if device_token.startswith("dead"):
+            return 410, "Unregistered"
+
+        r = random.random()
+        for rate, status, reason in (
+            (a.unregistered_rate, 410, "Unregistered"),
+            (a.bad_token_rate, 400, "BadDeviceToken"),
+            (a.too_many_rate, 429, "TooManyRequests"),
+            (a.error_rate, 500, "InternalServerError"),
+        ):
+            if r < rate:
+                return status, reason
+            r -= rate
+
+        return 200, None
+
+    def latency(self) -> float:
+        ms = self.args.latency_ms + random.uniform(0, self.args.jitter_ms)
+        return ms / 1000
+
+
+class APNsProtocol(asyncio.Protocol):
+    def __init__(self, mock: MockAPNs):
+        self.mock = mock
+        self.conn = H2Connection(config=H2Configuration(client_side=False, header_encoding="utf-8"))
+        self.streams: dict[int, dict] = {}
+        self.handled = 0
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.mock.stats.connections += 1
+        self.conn.initiate_connection()
+        self.flush()
+
+    def flush(self):
+        if self.transport and not self.transport.is_closing():
+            self.transport.write(self.conn.data_to_send())
+
+    def data_received(self, data: bytes):
+        for ev in self.conn.receive_data(data):
+            if isinstance(ev, RequestReceived):
+                self.streams[ev.stream_id] = {"headers": dict(ev.headers), "body": bytearray()}
+            elif isinstance(ev, DataReceived):
+                self.streams.get(ev.stream_id, {"body": bytearray()})["body"].extend(ev.data)
+                self.conn.acknowledge_received_data(ev.flow_controlled_length, ev.stream_id)
+            elif isinstance(ev, StreamEnded):
+                asyncio.ensure_future(self.respond(ev.stream_id))
+            elif isinstance(ev, StreamReset):
+                self.streams.pop(ev.stream_id, None)
+            elif isinstance(ev, ConnectionTerminated):
+                self.transport.close()
+        self.flush()
+
+    async def respond(self, stream_id: int):
+        req = self.streams.pop(stream_id, None)
+        if req is None:
+            return
+
+        await asyncio.sleep(self.mock.latency())
+
+        path = req["headers"].get(":path", "")
+        device_token = path.rsplit("/", 1)[-1]
+        status, reason = self.mock.outcome(req["headers"], device_token)
+
+        body = json.dumps({"reason": reason}).encode() if reason else b""
+        headers = [(":status", str(status)), ("apns-id", str(uuid.uuid4()).upper())]
+        if body:
+            headers += [("content-type", "application/json"), ("content-length", str(len(body)))]
+
+        try:
+            self.conn.send_headers(stream_id, headers, end_stream=not body)
+            if body:
+                self.conn.send_data(stream_id, body, end_stream=True)
+        except Exception:
+            return  # stream medzitým zavretý klientom
+
+        self.mock.stats.record(status, bytes(req["body"]))
+        self.handled += 1
+
+        goaway_after = self.mock.args.goaway_after
+        if goaway_after and self.handled >= goaway_after:
+            self.mock.stats.goaways += 1
+            self.conn.close_connection()
+            self.flush()
+            self.transport.close()
+            return
+
+        self.flush()
+
+
+async def stats_server(mock: MockAPNs, reader, writer):
+    await reader.readuntil(b"\r\n\r\n")
+    body = json.dumps(mock.stats.as_dict()).encode()
+    writer.write(
+        b"HTTP/1.1 200 OK\r\ncontent-type: application/json\r\n"
+        + f"content-length: {len(body)}\r\nconnection: close\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+    writer.close()
+
+
+async def report(mock: MockAPNs, every: float):
+    last = 0
+    while True:
+        await asyncio.sleep(every)
+        total = mock.stats.total
+        print(f"[mock-apns] {(total - last) / every:.1f} pushes/s, total {total}, {mock.stats.by_status}")
+        last = total
+
+
+def write_key(path: str):
+    """Vygeneruje EC P-256 kľúč (.p8 formát) pre lokálne podpisovanie provider tokenu."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+    with open(path, "wb") as f:
+        f.write(pem)
+    print(f"APNs test key written to {path}")
+
+
+async def main(args):
+    mock = MockAPNs(args)
+    loop = asyncio.get_running_loop()
+
+    server = await loop.create_server(lambda: APNsProtocol(mock), args.host, args.port)
+    await asyncio.start_server(lambda r, w: stats_server(mock, r, w), args.host, args.stats_port)
+    if args.report_every:
+        asyncio.ensure_future(report(mock, args.report_every))
+
+    print(f"[mock-apns] h2c on {args.host}:{args.port}, stats on :{args.stats_port}")
+    async with server:
+        await server.serve_forever()
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Local APNs HTTP/2 mock")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=2197)
+    p.add_argument("--stats-port", type=int, default=2198)
+    p.add_argument("--latency-ms", type=float, default=0)
+    p.add_argument("--jitter-ms", type=float, default=0)
+    p.add_argument("--unregistered-rate", type=float, default=0, help="podiel 410 Unregistered")
+    p.add_argument("--bad-token-rate", type=float, default=0, help="podiel 400 BadDeviceToken")
+    p.add_argument("--too-many-rate", type=float, default=0, help="podiel 429 TooManyRequests")
+    p.add_argument("--error-rate", type=float, default=0, help="podiel 500 InternalServerError")
+    p.add_argument("--goaway-after", type=int, default=0, help="GOAWAY po N streamoch na spojenie")
+    p.add_argument("--report-every", type=float, default=5)
+    p.add_argument("--write-key", metavar="PATH", help="iba vygeneruje testovací .p8 kľúč a skončí")
+    return p.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.write_key:
+        write_key(args.write_key)
+    else:
+        asyncio.run(main(args))
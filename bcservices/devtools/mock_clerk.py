@@ -0,0 +1,247 @@
+# apps/bcservices/bcservices/devtools/mock_clerk.py
+"""
+Lokálny stand-in za Clerk (JWKS + časť Backend API), všetko in-memory.
+
+- GET  /.well-known/jwks.json          – verejný RSA kľúč (kid "mock-1")
+- GET  /_test/token?sub=&role=&ttl=    – podpíše testovací session JWT (RS256, iss = --issuer)
+- GET  /v1/users?limit=&offset=        – zoznam userov
+- POST /v1/users                       – vytvorenie usera
+- GET|PATCH|DELETE /v1/users/<id>      – detail / úprava / zmazanie
+- PATCH /v1/users/<id>/metadata        – merge public_metadata
+- POST /v1/sign_in_tokens              – jednorazový sign-in token
+- GET  /_test/stats                    – počty requestov podľa endpointu
+
+    python -m bcservices.devtools.mock_clerk --port 8787 --latency-ms 30
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+KID = "mock-1"
+
+
+class ClerkState:
+    def __init__(self, args):
+        self.args = args
+        self.issuer = (args.issuer or f"http://{args.host}:{args.port}").rstrip("/")
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(self.key.public_key()))
+        jwk.update({"kid": KID, "alg": "RS256", "use": "sig"})
+        self.jwks = {"keys": [jwk]}
+
+        self.users: dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.hits: dict[str, int] = {}
+
+    def hit(self, name: str):
+        with self.lock:
+            self.hits[name] = self.hits.get(name, 0) + 1
+
+    def sign(self, sub: str, role: str | None, ttl: int) -> str:
+        now = int(time.time())
+        claims = {"sub": sub, "iss": self.issuer, "iat": now, "nbf": now - 5, "exp": now + ttl}
+        if role:
+            claims["role"] = role
+        return jwt.encode(claims, self.key, algorithm="RS256", headers={"kid": KID})
+
+    def new_user(self, body: dict, user_id: str | None = None) -> dict:
+        now_ms = int(time.time() * 1000)
+        user_id = user_id or f"user_{uuid.uuid4().hex[:24]}"
+        emails = body.get("email_address") or []
+        u = {
+            "id": user_id,
+            "object": "user",
+            "username": body.get("username"),
+            "email_addresses": [
+                {"id": f"idn_{uuid.uuid4().hex[:20]}", "email_address": e} for e in emails
+            ],
+            "public_metadata": body.get("public_metadata") or {},
+            "created_at": now_ms,
+            "updated_at": now_ms,
+        }
+        if u["email_addresses"]:
+            u["primary_email_address_id"] = u["email_addresses"][0]["id"]
+        with self.lock:
+            self.users[user_id] = u
+        return u
+
+    def user(self, user_id: str) -> dict:
+        u = self.users.get(user_id)
+        if u is None:
+            # neznámy sub z /_test/token → user „existuje“, ako v reálnom Clerku
+            u = self.new_user({"email_address": [f"{user_id}@example.test"]}, user_id)
+        return u
+
+
+def make_handler(state: ClerkState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def body(self) -> dict:
+            n = int(self.headers.get("content-length") or 0)
+            return json.loads(self.rfile.read(n) or b"{}") if n else {}
+
+        def authorized(self) -> bool:
+            if self.headers.get("authorization", "").startswith("Bearer "):
+                return True
+            self.reply(401, {"errors": [{"message": "Unauthorized", "code": "authentication_invalid"}]})
+            return False
+
+        def delay(self):
+            a = state.args
+            ms = a.latency_ms + random.uniform(0, a.jitter_ms)
+            if ms:
+                time.sleep(ms / 1000)
+            if a.error_rate and random.random() < a.error_rate:
+                self.reply(503, {"errors": [{"message": "Service unavailable", "code": "internal"}]})
+                return False
+            if a.rate_limit_rate and random.random() < a.rate_limit_rate:
+                self.send_response(429)
+                self.send_header("retry-after", "1")
+                self.send_header("content-length", "0")
+                self.end_headers()
+                return False
+            return True
+
+        def route(self, method: str):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            q = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+            # ---- test helpers & JWKS (bez latencie) ----
+            if method == "GET" and url.path == "/.well-known/jwks.json":
+                state.hit("jwks")
+                return self.reply(200, state.jwks)
+
+            if method == "GET" and url.path == "/_test/token":
+                sub = q.get("sub") or f"user_{uuid.uuid4().hex[:24]}"
+                state.user(sub)
+                if q.get("role"):
+                    state.users[sub]["public_metadata"]["role"] = q["role"]
+                token = state.sign(sub, q.get("role"), int(q.get("ttl") or 3600))
+                return self.reply(200, {"sub": sub, "jwt": token})
+
+            if method == "GET" and url.path == "/_test/stats":
+                return self.reply(200, {"hits": state.hits, "users": len(state.users)})
+
+            # ---- Backend API ----
+            if not parts or parts[0] != "v1":
+                return self.reply(404, {"errors": [{"message": "Not found"}]})
+            if not self.authorized() or not self.delay():
+                return
+
+            if parts[1:] == ["users"]:
+                if method == "GET":
+                    state.hit("users.list")
+                    users = sorted(state.users.values(), key=lambda u: u["created_at"])
+                    offset, limit = int(q.get("offset") or 0), int(q.get("limit") or 10)
+                    return self.reply(200, users[offset : offset + limit])
+                if method == "POST":
+                    state.hit("users.create")
+                    return self.reply(200, state.new_user(self.body()))
+
+            if len(parts) >= 3 and parts[1] == "users":
+                user_id = parts[2]
+
+                if len(parts) == 4 and parts[3] == "metadata" and method == "PATCH":
+                    state.hit("users.metadata")
+                    u = state.user(user_id)
+                    body = self.body()
+                    for key in ("public_metadata", "private_metadata", "unsafe_metadata"):
+                        if body.get(key):
+                            u.setdefault(key, {}).update(body[key])
+                    u["updated_at"] = int(time.time() * 1000)
+                    return self.reply(200, u)
+
+                if len(parts) == 3:
+                    if method == "GET":
+                        state.hit("users.get")
+                        return self.reply(200, state.user(user_id))
+                    if method == "PATCH":
+                        state.hit("users.update")
+                        u = state.user(user_id)
+                        body = self.body()
+                        if body.get("username"):
+                            u["username"] = body["username"]
+                        if body.get("public_metadata"):
+                            u["public_metadata"] = body["public_metadata"]
+                        u["updated_at"] = int(time.time() * 1000)
+                        return self.reply(200, u)
+                    if method == "DELETE":
+                        state.hit("users.delete")
+                        state.users.pop(user_id, None)
+                        return self.reply(200, {"id": user_id, "object": "user", "deleted": True})
+
+            if parts[1:] == ["sign_in_tokens"] and method == "POST":
+                state.hit("sign_in_tokens")
+                body = self.body()
+                return self.reply(
+                    200,
+                    {
+                        "id": f"sit_{uuid.uuid4().hex[:20]}",
+                        "user_id": body.get("user_id"),
+                        "token": uuid.uuid4().hex,
+                        "status": "pending",
+                    },
+                )
+
+            return self.reply(404, {"errors": [{"message": "Not found"}]})
+
+        def do_GET(self):
+            self.route("GET")
+
+        def do_POST(self):
+            self.route("POST")
+
+        def do_PATCH(self):
+            self.route("PATCH")
+
+        def do_DELETE(self):
+            self.route("DELETE")
+
+    return Handler
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Local Clerk JWKS / Backend API mock")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8787)
+    p.add_argument("--issuer", help="iss claim (default http://<host>:<port>)")
+    p.add_argument("--latency-ms", type=float, default=0)
+    p.add_argument("--jitter-ms", type=float, default=0)
+    p.add_argument("--error-rate", type=float, default=0, help="podiel 503 odpovedí")
+    p.add_argument("--rate-limit-rate", type=float, default=0, help="podiel 429 + Retry-After")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    state = ClerkState(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"[mock-clerk] {state.issuer} (jwks: {state.issuer}/.well-known/jwks.json)")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
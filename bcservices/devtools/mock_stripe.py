@@ -0,0 +1,210 @@
+# apps/bcservices/bcservices/devtools/mock_stripe.py
+"""
+Lokálny stand-in za Stripe Checkout.
+
+- POST /v1/checkout/sessions   – vytvorí session (form-encoded ako stripe-python),
+                                 vráti id + url
+- GET  /v1/checkout/sessions/<id>
+- po --complete-after-ms pošle na --webhook-url podpísaný
+  `checkout.session.completed` (Stripe-Signature: t=..,v1=HMAC-SHA256)
+- GET  /_test/stats            – počty sessions, webhookov a ich latencie
+
+    python -m bcservices.devtools.mock_stripe --port 12111 \
+        --webhook-url http://site.localhost:8000/api/method/bcservices.api.payment.stripe_webhook \
+        --webhook-secret whsec_local
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import requests
+
+
+def unflatten(pairs) -> dict:
+    """`metadata[paymentId]=x&line_items[0][quantity]=2` → vnorený dict."""
+    out: dict = {}
+    for key, value in pairs:
+        path = re.findall(r"[^\[\]]+", key)
+        node = out
+        for part in path[:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = value
+    return out
+
+
+def sign(payload: bytes, secret: str, ts: int | None = None) -> str:
+    ts = ts or int(time.time())
+    mac = hmac.new(secret.encode(), f"{ts}.".encode() + payload, hashlib.sha256).hexdigest()
+    return f"t={ts},v1={mac}"
+
+
+class StripeState:
+    def __init__(self, args):
+        self.args = args
+        self.sessions: dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.webhooks = ThreadPoolExecutor(max_workers=args.webhook_workers)
+        self.http = requests.Session()
+        self.stats = {"sessions": 0, "webhooks_ok": 0, "webhooks_failed": 0, "webhook_ms": []}
+
+    def create_session(self, params: dict) -> dict:
+        sid = f"cs_test_{uuid.uuid4().hex}"
+        amount = 0
+        for item in (params.get("line_items") or {}).values():
+            unit = int((item.get("price_data") or {}).get("unit_amount") or 0)
+            amount += unit * int(item.get("quantity") or 1)
+
+        session = {
+            "id": sid,
+            "object": "checkout.session",
+            "mode": params.get("mode") or "payment",
+            "currency": params.get("currency") or "eur",
+            "amount_total": amount,
+            "metadata": params.get("metadata") or {},
+            "payment_intent": f"pi_{uuid.uuid4().hex[:24]}",
+            "payment_status": "unpaid",
+            "status": "open",
+            "success_url": params.get("success_url"),
+            "cancel_url": params.get("cancel_url"),
+            "url": f"{self.args.public_url}/pay/{sid}",
+            "created": int(time.time()),
+        }
+        with self.lock:
+            self.sessions[sid] = session
+            self.stats["sessions"] += 1
+
+        if self.args.webhook_url and self.args.complete_after_ms >= 0:
+            self.webhooks.submit(self.complete, sid)
+        return session
+
+    def complete(self, sid: str):
+        time.sleep(self.args.complete_after_ms / 1000)
+        session = self.sessions[sid]
+
+        expire = self.args.expire_rate and random.random() < self.args.expire_rate
+        session.update(
+            {"status": "expired", "payment_status": "unpaid"}
+            if expire
+            else {"status": "complete", "payment_status": "paid"}
+        )
+
+        event = {
+            "id": f"evt_{uuid.uuid4().hex[:24]}",
+            "object": "event",
+            "api_version": "2024-06-20",
+            "created": int(time.time()),
+            "type": "checkout.session.expired" if expire else "checkout.session.completed",
+            "livemode": False,
+            "data": {"object": session},
+        }
+        payload = json.dumps(event).encode()
+
+        started = time.monotonic()
+        try:
+            r = self.http.post(
+                self.args.webhook_url,
+                data=payload,
+                headers={
+                    "content-type": "application/json",
+                    "stripe-signature": sign(payload, self.args.webhook_secret),
+                },
+                timeout=30,
+            )
+            ok = r.status_code == 200
+        except Exception:
+            ok = False
+
+        with self.lock:
+            self.stats["webhooks_ok" if ok else "webhooks_failed"] += 1
+            self.stats["webhook_ms"].append((time.monotonic() - started) * 1000)
+
+
+def make_handler(state: StripeState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def reply(self, status: int, body: dict):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(data)))
+            self.send_header("request-id", f"req_{uuid.uuid4().hex[:14]}")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            n = int(self.headers.get("content-length") or 0)
+            params = unflatten(parse_qsl(self.rfile.read(n).decode(), keep_blank_values=True))
+
+            if not self.headers.get("authorization"):
+                return self.reply(401, {"error": {"type": "invalid_request_error", "message": "No API key"}})
+
+            a = state.args
+            ms = a.latency_ms + random.uniform(0, a.jitter_ms)
+            if ms:
+                time.sleep(ms / 1000)
+
+            if path == "/v1/checkout/sessions":
+                return self.reply(200, state.create_session(params))
+            return self.reply(404, {"error": {"type": "invalid_request_error", "message": "Unrecognized request URL"}})
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+
+            if path == "/_test/stats":
+                with state.lock:
+                    ms = sorted(state.stats["webhook_ms"])
+                    stats = {k: v for k, v in state.stats.items() if k != "webhook_ms"}
+                stats["webhook_p50_ms"] = ms[len(ms) // 2] if ms else None
+                stats["webhook_p95_ms"] = ms[int(len(ms) * 0.95)] if ms else None
+                return self.reply(200, stats)
+
+            m = re.fullmatch(r"/v1/checkout/sessions/([\w]+)", path)
+            if m and m.group(1) in state.sessions:
+                return self.reply(200, state.sessions[m.group(1)])
+            return self.reply(404, {"error": {"type": "invalid_request_error", "message": "No such session"}})
+
+    return Handler
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Local Stripe Checkout mock")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=12111)
+    p.add_argument("--public-url", help="base pre session.url (default http://<host>:<port>)")
+    p.add_argument("--webhook-url", help="kam posielať checkout.session.* eventy")
+    p.add_argument("--webhook-secret", default="whsec_local")
+    p.add_argument("--complete-after-ms", type=float, default=200, help="-1 = žiadne automatické dokončenie")
+    p.add_argument("--expire-rate", type=float, default=0, help="podiel sessions, ktoré expirujú")
+    p.add_argument("--webhook-workers", type=int, default=8)
+    p.add_argument("--latency-ms", type=float, default=0)
+    p.add_argument("--jitter-ms", type=float, default=0)
+    args = p.parse_args(argv)
+    args.public_url = (args.public_url or f"http://{args.host}:{args.port}").rstrip("/")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(StripeState(args)))
+    server.daemon_threads = True
+    print(f"[mock-stripe] {args.public_url}, webhooks → {args.webhook_url or '(none)'}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -14,9 +14,17 @@ app_license = "unlicense"
 
 doc_events = {
     # Keď admin vytvorí BC Pouzivatel vo Frappe, založíme aj usera v Clerku a dáme mu role=client
+    # (na pozadí – uloženie dokumentu nečaká na Clerk)
     "BC Pouzivatel": {
+        "validate": "bcservices.api.auth.validate_bc_pouzivatel",
         "after_insert": "bcservices.api.auth.after_insert_bc_pouzivatel",
-        "on_update": "bcservices.api.auth.on_update_bc_pouzivatel"
+        "on_update": [
+            "bcservices.api.auth.on_update_bc_pouzivatel",
+            "bcservices.api.utils.on_bc_pouzivatel_change"
+        ],
+        # clerk_id → name resolver cache
+        "after_rename": "bcservices.api.utils.on_bc_pouzivatel_change",
+        "on_trash": "bcservices.api.utils.on_bc_pouzivatel_change"
     }
 }
 
@@ -160,23 +168,22 @@ override_whitelisted_methods = {
 # Scheduled Tasks
 # ---------------
 
-# scheduler_events = {
-# 	"all": [
-# 		"bcservices.tasks.all"
-# 	],
-# 	"daily": [
-# 		"bcservices.tasks.daily"
-# 	],
-# 	"hourly": [
-# 		"bcservices.tasks.hourly"
-# 	],
-# 	"weekly": [
-# 		"bcservices.tasks.weekly"
-# 	],
-# 	"monthly": [
-# 		"bcservices.tasks.monthly"
-# 	],
-# }
+scheduler_events = {
+    "cron": {
+        # visiace ringing / ongoing hovory → missed / ended
+        "* * * * *": [
+            "bcservices.api.call.sweep_stale_calls"
+        ]
+    },
+    "hourly": [
+        # Redis order book sekundárneho trhu ↔ otvorené BC Inzerat
+        "bcservices.api.orderbook.rebuild_order_book"
+    ],
+    "daily": [
+        # materializované počty tokenov ↔ BC Token
+        "bcservices.api.treasury.reconcile_supply"
+    ]
+}
 
 # Testing
 # -------
@@ -0,0 +1,11 @@
+import frappe
+
+
+def execute():
+	"""
+	Composite indexy pre keyset stránkovanie call.history.
+	InnoDB má v sekundárnom indexe implicitne aj primárny kľúč (name),
+	takže (caller, start_time) pokrýva aj tie-break `name` v cursore.
+	"""
+	frappe.db.add_index("BC Call", ["caller", "start_time"], "caller_start_time_index")
+	frappe.db.add_index("BC Call", ["advisor", "start_time"], "advisor_start_time_index")
@@ -0,0 +1,10 @@
+import frappe
+
+
+def execute():
+	"""
+	Index pre sweeper visiacich hovorov (status + start_time).
+	MariaDB nemá partial indexy – (status, start_time) zúži sken na malý
+	rozsah ringing / ongoing riadkov bez ohľadu na veľkosť histórie.
+	"""
+	frappe.db.add_index("BC Call", ["status", "start_time"], "status_start_time_index")
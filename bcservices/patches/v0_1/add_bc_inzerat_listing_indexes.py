@@ -0,0 +1,7 @@
+import frappe
+
+
+def execute():
+	"""Keyset stránkovanie market.listings (sort recent / price nad otvorenými listingami)."""
+	frappe.db.add_index("BC Inzerat", ["stav", "creation"], "stav_creation_index")
+	frappe.db.add_index("BC Inzerat", ["stav", "cena_eur"], "stav_cena_eur_index")
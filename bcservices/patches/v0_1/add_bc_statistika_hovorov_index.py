@@ -0,0 +1,10 @@
+import frappe
+
+
+def execute():
+	"""Čítanie štatistík = rozsah (pouzivatel, obdobie, zaciatok_obdobia)."""
+	frappe.db.add_index(
+		"BC Statistika Hovorov",
+		["pouzivatel", "obdobie", "zaciatok_obdobia"],
+		"pouzivatel_obdobie_index",
+	)
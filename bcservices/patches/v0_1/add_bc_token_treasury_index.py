@@ -0,0 +1,10 @@
+import frappe
+
+
+def execute():
+	"""Výber voľných treasury tokenov (claim_treasury_tokens) = krátky range scan."""
+	frappe.db.add_index(
+		"BC Token",
+		["vydany_rok", "stav", "aktualny_drzitel", "creation"],
+		"treasury_claim_index",
+	)
@@ -0,0 +1,6 @@
+from bcservices.api.treasury import reconcile_supply
+
+
+def execute():
+	"""Prvé naplnenie BC Zasoba Tokenov z existujúcich BC Token."""
+	reconcile_supply()
@@ -0,0 +1,56 @@
+import frappe
+from frappe.query_builder.functions import Count
+from frappe.utils import cint
+
+
+def execute():
+	"""
+	Pripraví BC Pouzivatel na unique index na `clerk_id` (pridá ho model sync):
+	- prázdny clerk_id → NULL (NULL unique index nekoliduje)
+	- duplicitné clerk_id sa zlúčia do najstaršieho záznamu: child zariadenia
+	  sa presunú explicitne (merge ich nepreparentuje, zmazal by ich spolu
+	  s duplikátom), linky prepíše rename s merge
+	"""
+	if not frappe.db.table_exists("BC Pouzivatel"):
+		return
+
+	User = frappe.qb.DocType("BC Pouzivatel")
+	frappe.qb.update(User).set(User.clerk_id, None).where(User.clerk_id == "").run()
+
+	dupes = (
+		frappe.qb.from_(User)
+		.select(User.clerk_id)
+		.where(User.clerk_id.isnotnull())
+		.groupby(User.clerk_id)
+		.having(Count("*") > 1)
+	).run(pluck=True)
+
+	for clerk_id in dupes:
+		names = frappe.get_all(
+			"BC Pouzivatel",
+			filters={"clerk_id": clerk_id},
+			order_by="creation asc",
+			pluck="name",
+		)
+		keep = names[0]
+		for dup in names[1:]:
+			_merge_into(dup, keep)
+
+
+def _merge_into(dup: str, keep: str):
+	_move_devices(dup, keep)
+	frappe.rename_doc("BC Pouzivatel", dup, keep, merge=True, force=True, show_alert=False)
+
+
+def _move_devices(source: str, target: str):
+	Device = frappe.qb.DocType("BC Zariadenie")
+	offset = cint(frappe.db.max("BC Zariadenie", "idx", {"parent": target, "parentfield": "zariadenie"}))
+
+	(
+		frappe.qb.update(Device)
+		.set(Device.parent, target)
+		.set(Device.idx, Device.idx + offset)
+		.where(Device.parent == source)
+		.where(Device.parenttype == "BC Pouzivatel")
+		.where(Device.parentfield == "zariadenie")
+	).run()